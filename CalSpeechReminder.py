@@ -16,39 +16,50 @@
 # (c) ulritter, 2021, GPL License 3.0
 #==========================================================
 #
-# TODO: better screen output
-# TODO: run as a daemon
 # TODO: include logging
 # TODO: move global variables to classes
-# TODO: reload prefs file
 #
 from __future__ import print_function
+import time
+# start of the module import, the startup time is reported against it
+import_started = time.perf_counter()
 from pathlib import Path
 import datetime
 import pickle
 import os
 import os.path
 import sys, getopt
-import urllib3
-import time
 import locale
 import threading
 from threading import Event
 import platform
 from datetime import date
-from gtts import gTTS
-from pydub import AudioSegment
-from pydub.playback import play
-from pydub.utils import get_player_name
 import tempfile
 import signal
 import subprocess
 import dateutil
 import dateutil.parser
 import json
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
+import hashlib
+import concurrent.futures
+import heapq
+import itertools
+import shutil
+import struct
+import sqlite3
+import types
+import random
+import collections
+import bisect
+import importlib.util
+import selectors
+import socket
+import contextlib
+# the Google client libraries, gTTS and pydub take seconds to import on a 
+# small machine, they are imported where they are used for the first time
+
+# startup has to stay snappy, the import of this module should take less (seconds)
+IMPORT_BUDGET = 0.25
 
 # If modifying these scopes, delete the file token.pickle.
 SCOPES = ['https://www.googleapis.com/auth/calendar.readonly']
@@ -56,6 +67,51 @@ SCOPES = ['https://www.googleapis.com/auth/calendar.readonly']
 global exit
 exit = Event()
 
+# set by SIGHUP, picked up by the main loop
+global reload_requested
+reload_requested = Event()
+
+# the blocking wait of the main loop
+global loop
+loop = None
+
+global speech_cache
+speech_cache = None
+
+global tts
+tts = None
+
+# one long-lived client per credential set, shared by calendars using the same credentials
+global calendar_clients
+calendar_clients = {}
+
+global calendar_sources
+calendar_sources = []
+
+global calendar_snapshot
+calendar_snapshot = None
+
+# Calendar API requests of the last 24 hours
+global api_quota
+api_quota = None
+
+# translations of all languages in prefs.json, calendars may speak different languages
+global locale_packs
+locale_packs = {}
+
+# settings in effect (read-only mapping) and the defaults they were built from
+global config
+config = None
+global default_settings
+default_settings = None
+
+# partial responses, only download what the alerts need
+EVENT_FIELDS = 'nextPageToken,nextSyncToken,items(id,status,summary,start,end,updated)'
+
+# seconds from playback request to the first sample handed to the player
+global playback_latency
+playback_latency = None
+
 # Code for getting keyboard input in a non-blocking way
 global isWindows
 
@@ -96,6 +152,10 @@ def load_default_language():
     global str_wrongdir
     global str_signal
     global str_exit_msg
+    global str_all_day
+    global str_latency
+    global str_data_age
+    global str_stale
   
     language = 'en_US'
     str_lookahead = 'Maximum number of events in preview: '
@@ -113,6 +173,10 @@ def load_default_language():
     str_wrongdir =    'is the wrong directory'
     str_signal = 'Exiting after signal: '
     str_exit_msg = 'One of the following keys terminates the program: '
+    str_all_day = 'all day'
+    str_latency = 'Time to first sample (ms):'
+    str_data_age = 'Calendar data age (minutes):'
+    str_stale = 'outdated'
 
 #
 #============================================================
@@ -124,13 +188,33 @@ def load_defaults():
     global str_divider
     global str_initial_sound_file
     global str_alert_sound_file
-    global str_tts_sound_file
-    global str_play_sound_file
     global alerts
     global number_events
     global refresh_timer
     global status_output
     global str_exit_chars
+    global tts_cache_dir
+    global tts_cache_max_mb
+    global tts_cache_max_days
+    global sync_mode
+    global sync_window_days
+    global calendars
+    global tts_engines
+    global tts_timeout
+    global metrics_port
+    global metrics_file
+    global snapshot_file
+    global refresh_mode
+    global refresh_min_minutes
+    global refresh_max_minutes
+    global api_daily_quota
+    global fetch_timeout
+    global stale_minutes
+    global sinks
+    global speech_fragments
+    global max_open_files
+    global max_threads
+    global max_rss_mb
 
     load_default_language()
     # operation system command to clear screen
@@ -142,9 +226,48 @@ def load_defaults():
     str_initial_sound_file = 'transporter.mp3'
     #theater gong :-)
     str_alert_sound_file = 'gong.mp3'
-    # temp file for generated tts sound
-    str_tts_sound_file = '_stmp.mp3'
-    str_play_sound_file = '_tmp.mp3'
+    # directory and limits for the text-to-speech cache, a size of 0 disables the cache
+    tts_cache_dir = '_tts_cache'
+    tts_cache_max_mb = 50
+    tts_cache_max_days = 30
+    # 'incremental' keeps a local copy of the calendar and only requests changes, 'full' re-lists the calendar on every refresh
+    sync_mode = 'incremental'
+    # number of days ahead covered by the local copy of the calendar in incremental mode
+    sync_window_days = 7
+    # calendars (rooms) to monitor, empty means the primary calendar with the settings above
+    calendars = []
+    # text-to-speech engines in order of preference: 'gtts' (Google, online), 'espeak' (espeak-ng, offline), 'pyttsx3' (offline), 'cache' (earlier results of any engine)
+    tts_engines = ['gtts', 'espeak', 'cache']
+    # seconds an engine may take before the next engine is tried
+    tts_timeout = 4.0
+    # port of the local Prometheus metrics endpoint (http://127.0.0.1:port/metrics), 0 disables it
+    metrics_port = 0
+    # file the metrics are written to once a minute, empty disables it
+    metrics_file = ''
+    # local snapshot of the calendars for instant start and offline operation, empty disables it
+    snapshot_file = '_events.sqlite'
+    # 'adaptive' fetches the calendars more often before alerts and after changes, 'fixed' every refresh_timer minutes
+    refresh_mode = 'adaptive'
+    # shortest time between two calendar fetches in adaptive mode
+    refresh_min_minutes = 1
+    # longest time between two calendar fetches in adaptive mode, and the longest backoff after errors
+    refresh_max_minutes = 60
+    # Calendar API requests per 24 hours this process may use
+    api_daily_quota = 2000
+    # seconds a Calendar API request may take, a fetch of all calendars still running after this time counts as failed
+    fetch_timeout = 30
+    # minutes after which the calendar data counts as outdated, 0 means twice refresh_max_minutes (adaptive) or refresh_timer (fixed)
+    stale_minutes = 0
+    # audio outputs every announcement is played on at the same time, empty means the default output
+    sinks = []
+    # build alerts from separately synthesized summary and "begins in" parts, so the parts are reused between the alerts of a meeting
+    speech_fragments = True
+    # open files (incl. sockets and pipes) above which no new text-to-speech or pre-rendering work is started, 0 means no limit
+    max_open_files = 256
+    # threads above which no new text-to-speech or pre-rendering work is started, 0 means no limit
+    max_threads = 64
+    # resident memory (MB) above which no new text-to-speech or pre-rendering work is started, 0 means no limit
+    max_rss_mb = 0
     # countdown delta minutes to trigger alert messages
     alerts = [1,5,10]
     # get next n google calendar events beginning from now
@@ -156,105 +279,171 @@ def load_defaults():
     # decides whether we play a sound (loke gong etc.) before we speak the string
     alert_sound = True    
 
+#
+#============================================================ 
+# the settings read from prefs.json, they live as global variables
+LOCALE_STRINGS = ('str_lookahead', 'str_begins', 'str_minutes', 'str_one_minute', 'str_no_event', 'str_reloaded',
+                  'str_on', 'str_stints', 'str_iteration', 'str_upcoming', 'str_events', 'str_nodir', 'str_wrongdir',
+                  'str_signal', 'str_exit_msg', 'str_all_day', 'str_latency', 'str_data_age', 'str_stale')
+# strings added later are optional, missing translations stay in English
+OPTIONAL_STRINGS = ('str_all_day', 'str_latency', 'str_data_age', 'str_stale')
+PREFS_SETTINGS = ('status_output', 'alert_sound', 'silence_file', 'language', 'str_exit_chars', 'str_divider',
+                  'str_initial_sound_file', 'str_alert_sound_file',
+                  'number_events', 'refresh_timer', 'tts_cache_dir', 'tts_cache_max_mb', 'tts_cache_max_days',
+                  'sync_mode', 'sync_window_days', 'calendars', 'tts_engines', 'tts_timeout', 'metrics_port',
+                  'metrics_file', 'snapshot_file', 'alerts', 'locale_packs', 'refresh_mode', 'refresh_min_minutes',
+                  'refresh_max_minutes', 'api_daily_quota', 'fetch_timeout', 'stale_minutes', 'sinks', 'speech_fragments',
+                  'max_open_files', 'max_threads', 'max_rss_mb') + LOCALE_STRINGS
+
+#
+#============================================================ 
+def current_settings():
+    """Return the settings in effect (e.g. the defaults) as read-only mapping"""
+    return types.MappingProxyType(dict((_name, globals()[_name]) for _name in PREFS_SETTINGS))
+
+#
+#============================================================ 
+def apply_config(settings):
+    """Make settings the active configuration. All globals are replaced in 
+    one step, so no other thread ever sees a half applied prefs file"""
+    _values = dict(settings)
+    _values['config'] = settings
+    globals().update(_values)
+
+#
+#============================================================ 
+def read_prefs(prefs_file, defaults):
+    """Read and check prefs.json, return the settings as read-only mapping.
+    Settings missing in the file are taken from defaults, any error raises,
+    so a broken file never replaces a working configuration"""
+    with open(prefs_file) as f:
+        _prefs = json.load(f)
+    _config = dict(defaults)
+    _config['status_output'] = _prefs['status_output'] == 'on'
+    _config['alert_sound'] = _prefs['str_alert_sound'] == 'on'
+    for _name in ('silence_file', 'language', 'str_exit_chars', 'str_divider', 'str_initial_sound_file',
+                  'str_alert_sound_file'):
+        _config[_name] = _prefs[_name]
+    _config['number_events'] = int(_prefs['number_events'])
+    _config['refresh_timer'] = int(_prefs['refresh_timer'])
+    # cache settings are optional so that older prefs files keep working
+    _config['tts_cache_dir'] = _prefs.get('tts_cache_dir', defaults['tts_cache_dir'])
+    _config['tts_cache_max_mb'] = int(_prefs.get('tts_cache_max_mb', defaults['tts_cache_max_mb']))
+    _config['tts_cache_max_days'] = int(_prefs.get('tts_cache_max_days', defaults['tts_cache_max_days']))
+    _config['sync_mode'] = _prefs.get('sync_mode', defaults['sync_mode'])
+    _config['sync_window_days'] = int(_prefs.get('sync_window_days', defaults['sync_window_days']))
+    _config['calendars'] = _prefs.get('calendars', defaults['calendars'])
+    _config['tts_engines'] = _prefs.get('tts_engines', defaults['tts_engines'])
+    _config['tts_timeout'] = float(_prefs.get('tts_timeout', defaults['tts_timeout']))
+    _config['metrics_port'] = int(_prefs.get('metrics_port', defaults['metrics_port']))
+    _config['metrics_file'] = _prefs.get('metrics_file', defaults['metrics_file'])
+    _config['snapshot_file'] = _prefs.get('snapshot_file', defaults['snapshot_file'])
+    _config['refresh_mode'] = _prefs.get('refresh_mode', defaults['refresh_mode'])
+    _config['refresh_min_minutes'] = int(_prefs.get('refresh_min_minutes', defaults['refresh_min_minutes']))
+    _config['refresh_max_minutes'] = int(_prefs.get('refresh_max_minutes', defaults['refresh_max_minutes']))
+    _config['api_daily_quota'] = int(_prefs.get('api_daily_quota', defaults['api_daily_quota']))
+    _config['fetch_timeout'] = int(_prefs.get('fetch_timeout', defaults['fetch_timeout']))
+    _config['stale_minutes'] = int(_prefs.get('stale_minutes', defaults['stale_minutes']))
+    _config['sinks'] = _prefs.get('sinks', defaults['sinks'])
+    _config['speech_fragments'] = _prefs.get('speech_fragments', defaults['speech_fragments']) in (True, 'on')
+    _config['max_open_files'] = int(_prefs.get('max_open_files', defaults['max_open_files']))
+    _config['max_threads'] = int(_prefs.get('max_threads', defaults['max_threads']))
+    _config['max_rss_mb'] = int(_prefs.get('max_rss_mb', defaults['max_rss_mb']))
+    _config['alerts'] = [int(alert['alert_time']) for alert in _prefs['alerts']]
+
+    if _config['number_events'] < 1 or _config['refresh_timer'] < 1:
+        raise ValueError('number_events and refresh_timer have to be at least 1')
+    if _config['sync_mode'] not in ('incremental', 'full'):
+        raise ValueError('unknown sync_mode ' + str(_config['sync_mode']))
+    if _config['refresh_mode'] not in ('adaptive', 'fixed'):
+        raise ValueError('unknown refresh_mode ' + str(_config['refresh_mode']))
+    if not 1 <= _config['refresh_min_minutes'] <= _config['refresh_max_minutes']:
+        raise ValueError('refresh_min_minutes has to be at least 1 and at most refresh_max_minutes')
+    for _calendar in _config['calendars']:
+        if 'calendar_id' not in _calendar:
+            raise KeyError('calendar_id')
+        output_sinks(_calendar.get('sink', ''))
+    output_sinks(_config['sinks'])
+
+    _config['locale_packs'] = dict((_locale['lang'], _locale) for _locale in _prefs['locales'])
+    _locale = _config['locale_packs'].get(_config['language'])
+    if _locale is None:
+        # if the prefs.json "language" entry is not matched by any of the translations
+        # fill default language entries         
+        print('Language ', _config['language'],' not found. Still starting, but with defaults ...')
+        for _name in ('language',) + LOCALE_STRINGS:
+            _config[_name] = defaults[_name]
+    else:
+        for _name in LOCALE_STRINGS:
+            if _name in OPTIONAL_STRINGS:
+                _config[_name] = _locale.get(_name, defaults[_name])
+            else:
+                _config[_name] = _locale[_name]
+    return types.MappingProxyType(_config)
+
 #
 #============================================================ 
 def get_prefs(prefs_file):
     """Load preferences and localized strings from prefs.json"""
-    global status_output
-    global alert_sound
-    global str_divider
-    global str_initial_sound_file
-    global str_alert_sound_file
-    global str_tts_sound_file
-    global str_play_sound_file
-    global alerts
-    global number_events
-    global refresh_timer
-    global status_output
-    global language
-    global str_lookahead
-    global str_begins
-    global str_minutes 
-    global str_one_minute
-    global str_no_event
-    global str_reloaded 
-    global str_stints
-    global str_iteration
-    global str_upcoming
-    global str_events
-    global str_on
-    global str_nodir
-    global str_wrongdir
-    global str_exit_chars 
-    global str_signal
-    global str_exit_msg
-    global silence_file
-    
+    global default_settings
+    # whatever is in effect now (the defaults) fills the gaps of the prefs file
+    default_settings = current_settings()
     try:
-        with open(prefs_file) as f:
-            try:
-                _prefs = json.load(f)
-                if _prefs['status_output'] == 'on':
-                    status_output = True
-                else:
-                    status_output = False
-                
-                if _prefs['str_alert_sound'] == 'on':
-                    alert_sound = True
-                else:
-                    alert_sound = False
-                silence_file = _prefs['silence_file']
-                language = _prefs['language']
-                str_exit_chars = _prefs['str_exit_chars']
-                str_divider = _prefs['str_divider']
-                str_initial_sound_file = _prefs['str_initial_sound_file']
-                str_alert_sound_file = _prefs['str_alert_sound_file']
-                str_tts_sound_file = _prefs['str_tts_sound_file']
-                str_play_sound_file = _prefs['str_play_sound_file']
-                number_events = int(_prefs['number_events'])
-                refresh_timer = int(_prefs['refresh_timer'])
-            
-                alerts=[]
-                for alert in _prefs['alerts']:
-                    alerts.append(int(alert['alert_time']))
+        apply_config(read_prefs(prefs_file, default_settings))
                 
-                _language_found = False
-                for _locale in _prefs['locales']:
-                    if _locale['lang'] == language:
-                        _language_found = True
-                        str_lookahead = _locale['str_lookahead']
-                        str_begins = _locale['str_begins']
-                        str_minutes = _locale['str_minutes']
-                        str_one_minute = _locale['str_one_minute']
-                        str_no_event = _locale['str_no_event']
-                        str_reloaded = _locale['str_reloaded']
-                        str_on = _locale['str_on']
-                        str_stints = _locale['str_stints']
-                        str_iteration = _locale['str_iteration']
-                        str_upcoming = _locale['str_upcoming']
-                        str_events = _locale['str_events']
-                        str_nodir = _locale['str_nodir']
-                        str_wrongdir = _locale['str_wrongdir']
-                        str_signal = _locale['str_signal']
-                        str_exit_msg = _locale['str_exit_msg']
-                    
-                # if the prefs.json "language" entry is not matched by any of the translations
-                # fill default language entries         
-                if not _language_found:
-                    print('Language ', language,' not found. Still starting, but with defaults ...')
-                    time.sleep(5)
-                    load_default_language()
-                
-            # fill defaults in case of any json parsing issue (delimiter missing, etc)            
-            except (ValueError, KeyError) as jerr:
-                print('Value or Key Error: Please check prefs file. Still starting, but with defaults ...:', jerr)
-                time.sleep(5)
-                load_defaults()
+    # fill defaults in case of any json parsing issue (delimiter missing, etc)            
+    except (ValueError, KeyError, TypeError) as jerr:
+        print('Value or Key Error: Please check prefs file. Still starting, but with defaults ...:', jerr)
+        time.sleep(5)
+        apply_config(default_settings)
                 
     except (EnvironmentError) as jerr:
         print('Environment error. Please check prefs file. Still starting, but with defaults ...:', jerr)
         time.sleep(5)
-        load_defaults()
+        apply_config(default_settings)
+
+#
+#============================================================ 
+def reload_prefs(prefs_file):
+    """Read prefs.json again while running. A broken file keeps the current 
+    settings, returns the names of the settings which changed"""
+    try:
+        _config = read_prefs(prefs_file, default_settings)
+    except (EnvironmentError, ValueError, KeyError, TypeError) as jerr:
+        print('Please check prefs file, keeping the current settings:', jerr)
+        return set()
+    _changed = set(_name for _name in PREFS_SETTINGS if _config[_name] != config[_name])
+    apply_config(_config)
+    return _changed
+
+#
+#============================================================ 
+class prefs_watcher():
+    """Notice changes of prefs.json by polling its modification time, 
+    cheap enough to do every few seconds. No interval: never poll"""
+    def __init__(self, path, interval=5):
+        self.path = path
+        self.interval = interval
+        self.stamp = self._stamp()
+        self.next_check = clock.time() + interval if interval else float('inf')
+
+    def _stamp(self):
+        try:
+            _stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (_stat.st_mtime_ns, _stat.st_size)
+
+    def changed(self, now):
+        """Return True once after the file was changed"""
+        if now < self.next_check:
+            return False
+        self.next_check = now + self.interval
+        _stamp = self._stamp()
+        if _stamp == self.stamp:
+            return False
+        self.stamp = _stamp
+        return True
     
 #
 #============================================================
@@ -262,6 +451,261 @@ def get_prefs(prefs_file):
 #============================================================
 #
 
+#============================================================
+class system_clock():
+    """The clock all scheduling decisions are based on. The replay mode swaps 
+    in a virtual clock, so weeks of alerts can be run through in seconds"""
+    def time(self):
+        return time.time()
+
+#
+#============================================================
+class virtual_clock():
+    """Clock of the replay mode, its time only moves on when it is advanced"""
+    def __init__(self, start):
+        self.now = start
+
+    def time(self):
+        return self.now
+
+    def advance(self, to):
+        self.now = max(self.now, to)
+
+global clock
+clock = system_clock()
+
+#
+#============================================================
+class metrics_registry():
+    """Counters, gauges and latency histograms of the running daemon, rendered in
+    the Prometheus text format. While disabled every call returns right
+    away, so the instrumentation costs next to nothing"""
+    # histogram bucket bounds in seconds
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    @staticmethod
+    def _labels(labels, extra=''):
+        _text = ','.join('%s="%s"' % (_name, str(_value).replace('"', "'")) for _name, _value in sorted(labels.items()))
+        if extra:
+            _text = _text + ',' + extra if _text else extra
+        return '{' + _text + '}' if _text else ''
+
+    def inc(self, name, amount=1, **labels):
+        if not self.enabled:
+            return
+        _key = (name, self._labels(labels))
+        with self.lock:
+            self.counters[_key] = self.counters.get(_key, 0) + amount
+
+    def gauge(self, name, value, **labels):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.gauges[(name, self._labels(labels))] = value
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        _key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            _histogram = self.histograms.get(_key)
+            if _histogram is None:
+                _histogram = self.histograms[_key] = [[0]*len(self.buckets), 0.0, 0]
+            _index = bisect.bisect_left(self.buckets, value)
+            if _index < len(self.buckets):
+                _histogram[0][_index] += 1
+            _histogram[1] += value
+            _histogram[2] += 1
+
+    @contextlib.contextmanager
+    def _timer(self, name, labels):
+        _started = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - _started, **labels)
+
+    def timer(self, name, **labels):
+        """Context manager observing the time spent in the block"""
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self._timer(name, labels)
+
+    def render(self):
+        """Return all metrics in the Prometheus text format"""
+        _lines = []
+        with self.lock:
+            _types = set()
+            for (_name, _labels), _value in sorted(self.counters.items()):
+                if _name not in _types:
+                    _types.add(_name)
+                    _lines.append('# TYPE %s counter' % _name)
+                _lines.append('%s%s %s' % (_name, _labels, _value))
+            for (_name, _labels), _value in sorted(self.gauges.items()):
+                if _name not in _types:
+                    _types.add(_name)
+                    _lines.append('# TYPE %s gauge' % _name)
+                _lines.append('%s%s %s' % (_name, _labels, _value))
+            for (_name, _labels), (_counts, _sum, _count) in sorted(self.histograms.items()):
+                if _name not in _types:
+                    _types.add(_name)
+                    _lines.append('# TYPE %s histogram' % _name)
+                _labels = dict(_labels)
+                _cumulative = 0
+                for _bound, _bucket in zip(self.buckets, _counts):
+                    _cumulative += _bucket
+                    _lines.append('%s_bucket%s %d' % (_name, self._labels(_labels, 'le="%s"' % _bound), _cumulative))
+                _lines.append('%s_bucket%s %d' % (_name, self._labels(_labels, 'le="+Inf"'), _count))
+                _lines.append('%s_sum%s %f' % (_name, self._labels(_labels), _sum))
+                _lines.append('%s_count%s %d' % (_name, self._labels(_labels), _count))
+        return '\n'.join(_lines) + '\n'
+
+    def write(self, path):
+        """Write the metrics to a file, replaced atomically for readers"""
+        with open(path + '.tmp', 'w') as f:
+            f.write(self.render())
+        os.replace(path + '.tmp', path)
+
+    def serve(self, port):
+        """Serve the metrics on http://127.0.0.1:port/metrics from a background thread"""
+        import http.server
+        _registry = self
+
+        class _handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                _body = _registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(_body)))
+                self.end_headers()
+                self.wfile.write(_body)
+
+            def log_message(self, format, *args):
+                # keep the console clean
+                pass
+
+        _server = http.server.ThreadingHTTPServer(('127.0.0.1', port), _handler)
+        _thread = threading.Thread(target=_server.serve_forever)
+        _thread.daemon = True
+        _thread.start()
+        return _server
+
+global metrics
+metrics = metrics_registry()
+
+#
+#============================================================
+class resource_watchdog():
+    """Watch the open files, threads and resident memory of the process. 
+    Samples are kept for a day, their trend (growth per hour) shows leaks 
+    long before they hurt. Past one of the ceilings from prefs.json no new
+    work (text-to-speech, pre-rendering) is started"""
+    def __init__(self, interval=60, window=6*3600):
+        self.interval = interval
+        self.window = window
+        self.samples = collections.deque(maxlen=int(86400/interval))
+        self.exceeded = None
+        self.next_sample = 0
+        self.next_report = 0
+
+    @staticmethod
+    def open_files():
+        """Return the number of open file descriptors or None if unknown"""
+        for _directory in ('/proc/self/fd', '/dev/fd'):
+            try:
+                # listdir has the directory open itself
+                return len(os.listdir(_directory)) - 1
+            except OSError:
+                pass
+        return None
+
+    @staticmethod
+    def rss():
+        """Return the resident memory in bytes or None if unknown"""
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, AttributeError):
+            pass
+        try:
+            import resource
+        except ImportError:
+            return None
+        # the peak only, in kB on Linux and bytes on MacOs
+        _peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return _peak if platform.system() == 'Darwin' else _peak*1024
+
+    def trend(self, index, now):
+        """Return the growth per hour of one of the sampled values over the 
+        window (least squares), None with too few samples"""
+        _points = [(_sample[0], _sample[index]) for _sample in self.samples 
+                   if _sample[0] >= now - self.window and _sample[index] is not None]
+        if len(_points) < 2:
+            return None
+        _mean_t = sum(_t for _t, _v in _points)/len(_points)
+        _mean_v = sum(_v for _t, _v in _points)/len(_points)
+        _spread = sum((_t - _mean_t)**2 for _t, _v in _points)
+        if not _spread:
+            return None
+        return sum((_t - _mean_t)*(_v - _mean_v) for _t, _v in _points)/_spread*3600
+
+    def sample(self, now):
+        """Take a sample, check the ceilings and report the trends once an hour"""
+        self.next_sample = now + self.interval
+        _sample = (now, self.open_files(), threading.active_count(), self.rss())
+        self.samples.append(_sample)
+        metrics.gauge('calspeech_threads', _sample[2])
+        if _sample[1] is not None:
+            metrics.gauge('calspeech_open_files', _sample[1])
+        if _sample[3] is not None:
+            metrics.gauge('calspeech_rss_bytes', _sample[3])
+        _exceeded = None
+        for _value, _ceiling, _name in ((_sample[1], max_open_files, 'open files'), (_sample[2], max_threads, 'threads'), 
+                                        (_sample[3], max_rss_mb*1024*1024, 'memory')):
+            if _ceiling and _value is not None and _value > _ceiling:
+                _exceeded = '%s %d > %d' % (_name, _value, _ceiling)
+        if _exceeded != self.exceeded:
+            if _exceeded is not None:
+                print('Resource ceiling exceeded, no new work is started:', _exceeded)
+            else:
+                print('Resources back below their ceilings')
+            self.exceeded = _exceeded
+        if now >= self.next_report:
+            self.next_report = now + 3600
+            print(self.report(now))
+
+    def report(self, now):
+        """One line with the current values and their growth per hour"""
+        _last = self.samples[-1]
+        _parts = []
+        for _index, _name, _scale, _unit in ((1, 'open files', 1, ''), (2, 'threads', 1, ''), (3, 'RSS', 1024*1024, ' MB')):
+            if _last[_index] is None:
+                continue
+            _trend = self.trend(_index, now)
+            _parts.append('%s %s%s (%s/h)' % (_name, '%.1f' % (_last[_index]/_scale) if _unit else _last[_index], _unit, 
+                                             '-' if _trend is None else '%+.1f' % (_trend/_scale)))
+        return 'Resources: ' + ', '.join(_parts)
+
+    def refused(self):
+        """Return why no new work may be started, or None"""
+        if max_threads and threading.active_count() > max_threads:
+            return 'threads %d > %d' % (threading.active_count(), max_threads)
+        return self.exceeded
+
+global resources
+resources = resource_watchdog()
+
+#
 #============================================================
 class key_poller():
     """Non-blocking poll for key strokes in either Windows of Linux environments"""
@@ -324,88 +768,1882 @@ class key_poller():
 
 #
 #============================================================
-def clear_screen():
-    """Clear the console screen"""
-    os.system(str_clear)
+class status_renderer():
+    """Draw the status screen without spawning any processes. On a terminal
+    only the lines which changed since the last update are redrawn via ANSI 
+    escape sequences. If stdout is not a terminal (log file, journal) the 
+    changed lines are printed as plain log lines instead.
+    While the screen is drawn, everything printed by other code (refresh,
+    audio and prerender threads) is captured and the latest messages are
+    shown below the status lines, so nothing shifts the screen"""
+    def __init__(self, stream=sys.stdout):
+        self.stream = stream
+        self.tty = stream.isatty() and self._enable_ansi()
+        self.lines = None
+        self.messages = None
+        self.saved_stdout = None
+
+    def _enable_ansi(self):
+        if not isWindows:
+            return True
+        # Windows 10 consoles understand ANSI sequences once asked to
+        try:
+            import ctypes
+            _kernel32 = ctypes.windll.kernel32
+            _handle = _kernel32.GetStdHandle(-11)
+            _mode = ctypes.c_uint32()
+            _kernel32.GetConsoleMode(_handle, ctypes.byref(_mode))
+            return bool(_kernel32.SetConsoleMode(_handle, _mode.value | 0x0004))
+        except Exception:
+            return False
+
+    def invalidate(self):
+        """Redraw everything next time, e.g. after something else was printed"""
+        self.lines = None
+
+    def capture(self):
+        """Route print() of all threads through the renderer, on a terminal only"""
+        if self.tty and self.messages is None:
+            self.messages = status_messages(self.stream)
+            self.saved_stdout = sys.stdout
+            sys.stdout = self.messages
+
+    def release(self):
+        """Give stdout back, e.g. when the status screen is switched off"""
+        if self.messages is not None:
+            sys.stdout = self.saved_stdout
+            # messages printed after the last update, e.g. on exit
+            for _line in self.messages.lines:
+                if _line not in (self.lines or []):
+                    self.stream.write(_line + '\n')
+            self.stream.flush()
+            self.messages = None
+
+    def render(self, lines):
+        if self.messages is not None and self.messages.lines:
+            lines = list(lines) + [''] + list(self.messages.lines)
+        if not self.tty:
+            _old = set(self.lines or [])
+            _stamp = time.strftime('%Y-%m-%d %H:%M:%S ')
+            for _line in lines:
+                if _line not in _old:
+                    self.stream.write(_stamp + _line + '\n')
+        else:
+            _out = []
+            if self.lines is None:
+                # clear screen and home cursor
+                _out.append('\x1b[2J')
+            for _row, _line in enumerate(lines):
+                if self.lines is None or _row >= len(self.lines) or self.lines[_row] != _line:
+                    # go to the row, write it and clear the rest of it
+                    _out.append('\x1b[%d;1H%s\x1b[K' % (_row+1, _line))
+            if self.lines is not None and len(self.lines) > len(lines):
+                # clear whatever is left below
+                _out.append('\x1b[%d;1H\x1b[J' % (len(lines)+1))
+            _out.append('\x1b[%d;1H' % (len(lines)+1))
+            self.stream.write(''.join(_out))
+        self.stream.flush()
+        self.lines = list(lines)
+
+#
+#============================================================
+class status_messages():
+    """Stand-in for sys.stdout while the status screen is drawn, keeps the
+    latest printed lines for the renderer"""
+    def __init__(self, stream, keep=5):
+        self.stream = stream
+        self.lines = collections.deque(maxlen=keep)
+        self.partial = ''
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        with self.lock:
+            _lines = (self.partial + text).split('\n')
+            self.partial = _lines.pop()
+            for _line in _lines:
+                if _line.strip():
+                    self.lines.append(time.strftime('%H:%M:%S ') + _line)
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
 
 #
 #============================================================
-def get_events(number_events):
-        """Load events from Google Calendar
+class calendar_client():
+        """Google Calendar client which is built once and reused for the whole process.
+        Keeps one authorized keep-alive HTTP connection (gzip enabled), uses 
+        the discovery document bundled with google-api-python-client 2.x and 
+        refreshes the credentials only when the access token is about to expire"""
+        # refresh this long before the access token expires
+        refresh_margin = datetime.timedelta(minutes=5)
+
+        def __init__(self, token_file, credentials_file):
+                self.token_file = token_file
+                self.credentials_file = credentials_file
+                self.creds = None
+                self.service = None
+                self.lock = threading.Lock()
+
+        def _save_credentials(self):
+                with open(self.token_file, 'wb') as token:
+                        pickle.dump(self.creds, token)
+
+        def _check_credentials(self):
+                """Load, refresh or obtain credentials where needed"""
+                # The token file stores the user's access and refresh tokens, and is
+                # created automatically when the authorization flow completes for the first
+                # time.
+                if self.creds is None and os.path.exists(self.token_file):
+                        with open(self.token_file, 'rb') as token:
+                                self.creds = pickle.load(token)
+                if self.creds is None or not (self.creds.valid or self.creds.refresh_token):
+                        # no (usable) credentials available, let the user log in
+                        from google_auth_oauthlib.flow import InstalledAppFlow
+                        flow = InstalledAppFlow.from_client_secrets_file(self.credentials_file, SCOPES)
+                        self.creds = flow.run_local_server(port=0)
+                        self._save_credentials()
+                        self.service = None
+                elif self.creds.refresh_token and self.creds.expiry is not None and \
+                                self.creds.expiry - datetime.datetime.utcnow() < self.refresh_margin:
+                        from google.auth.transport.requests import Request
+                        self.creds.refresh(Request())
+                        self._save_credentials()
+
+        def get_service(self):
+                """Return the Calendar service, building it on first use"""
+                with self.lock:
+                        self._check_credentials()
+                        if self.service is None:
+                                import httplib2
+                                from google_auth_httplib2 import AuthorizedHttp
+                                from googleapiclient.discovery import build
+                                from googleapiclient.http import set_user_agent
+                                _http = AuthorizedHttp(self.creds, http=httplib2.Http(timeout=fetch_timeout))
+                                # Google APIs only answer gzipped if the user agent asks for it as well
+                                _http = set_user_agent(_http, 'CalSpeechReminder (gzip)')
+                                # the bundled discovery document, building the service needs no network round trip
+                                self.service = build('calendar', 'v3', http=_http, static_discovery=True)
+                        return self.service
+
+        def check(self):
+                """Check the credentials without network access (--check), return 
+                whether they can be used without a login in the browser and a description"""
+                if os.path.exists(self.token_file):
+                        with open(self.token_file, 'rb') as token:
+                                _creds = pickle.load(token)
+                        if _creds.valid:
+                                return True, self.token_file + ': valid until ' + str(_creds.expiry)
+                        if _creds.refresh_token:
+                                return True, self.token_file + ': expired, is refreshed on first use'
+                if os.path.exists(self.credentials_file):
+                        return False, self.token_file + ': no usable token, a login in the browser is needed'
+                raise EnvironmentError('neither ' + self.token_file + ' nor ' + self.credentials_file + ' found')
+
+#
+#============================================================
+def get_calendar_client(token_file, credentials_file):
+        """Return the long-lived Google Calendar client for a credential set
         code snippet from Google Developer website: https://developers.google.com/calendar/quickstart/python
         the website also includes instructions on how to set up the integration
-        Shows basic usage of the Google Calendar API.
-        Prints the start and name of the next 10 events on the user's calendar.
         """
-        creds = None
-        # The file token.pickle stores the user's access and refresh tokens, and is
-        # created automatically when the authorization flow completes for the first
-        # time.
-        if os.path.exists(filepath+'.'+path_delim+'token.pickle'):
-                with open(filepath+'.'+path_delim+'token.pickle', 'rb') as token:
-                        creds = pickle.load(token)
-        # If there are no (valid) credentials available, let the user log in.
-        if not creds or not creds.valid:
-                if creds and creds.expired and creds.refresh_token:
-                        creds.refresh(Request())
+        if token_file not in calendar_clients:
+                calendar_clients[token_file] = calendar_client(token_file, credentials_file)
+        return calendar_clients[token_file]
+
+#
+#============================================================
+def event_start(event):
+        """Return the start of an event as time zone aware datetime,
+        all-day events start at local midnight"""
+        if event['start'].get('dateTime') is not None:
+                return dateutil.parser.parse(event['start']['dateTime'])
+        return dateutil.parser.parse(event['start']['date']).astimezone()
+
+#
+#============================================================
+def event_end(event):
+        """Return the end of an event as time zone aware datetime"""
+        _end = event.get('end', event['start'])
+        if _end.get('dateTime') is not None:
+                return dateutil.parser.parse(_end['dateTime'])
+        return dateutil.parser.parse(_end['date']).astimezone()
+
+#
+#============================================================
+class event_record():
+        """One calendar event, converted once when it is fetched. Start and end
+        are epoch seconds, so there is no time zone or DST handling later on.
+        All-day events start at local midnight and get no spoken alerts"""
+        __slots__ = ('id', 'start', 'end', 'summary', 'status', 'all_day')
+
+        def __init__(self, id, start, end, summary, status='confirmed', all_day=False):
+                self.id = id
+                self.start = start
+                self.end = end
+                self.summary = summary
+                self.status = status
+                self.all_day = all_day
+
+        @classmethod
+        def from_item(cls, item):
+                """Convert an event as returned by the Calendar API"""
+                return cls(item['id'], event_start(item).timestamp(), event_end(item).timestamp(), 
+                           item.get('summary'), item.get('status', 'confirmed'), item['start'].get('dateTime') is None)
+
+#
+#============================================================
+class event_index():
+        """Events of one calendar sorted by start time. The list is never
+        changed, a refresh builds a new index, so it can be handed to other 
+        threads as is"""
+        def __init__(self, records=()):
+                self.records = sorted(records, key=lambda record: record.start)
+                self.starts = [_record.start for _record in self.records]
+
+        def __iter__(self):
+                return iter(self.records)
+
+        def __len__(self):
+                return len(self.records)
+
+        def signature(self):
+                """Identify the content of the index, to notice changes of the calendar"""
+                return hash(tuple((_record.id, _record.start, _record.end, _record.summary) for _record in self.records))
+
+        def between(self, begin, end=float('inf')):
+                """Return the events starting in [begin, end)"""
+                return self.records[bisect.bisect_left(self.starts, begin):bisect.bisect_left(self.starts, end)]
+
+#
+#============================================================
+class event_store():
+        """Local copy of a calendar which is kept up to date by requesting only 
+        changes (sync token, or updatedMin if the API does not hand out a token).
+        Inserts, updates and cancellations are applied to the local copy, an 
+        expired sync token (HTTP 410) triggers a full resync.
+        The service only needs to provide events().list(...).execute(), so a 
+        local stand-in of the Calendar API can be used for testing"""
+        def __init__(self, calendar_id='primary', window_days=7):
+                self.calendar_id = calendar_id
+                self.window = datetime.timedelta(days=window_days)
+                self.events = {}
+                self.sync_token = None
+                self.updated_min = None
+                self.last_full_sync = None
+
+        def _list(self, service, **kwargs):
+                """Run events().list() over all result pages, return items and the next sync token"""
+                _items = []
+                _page_token = None
+                while True:
+                        if _page_token is not None:
+                                kwargs['pageToken'] = _page_token
+                        get_api_quota().record()
+                        _result = service.events().list(calendarId=self.calendar_id, singleEvents=True, 
+                                                                                        maxResults=250, fields=EVENT_FIELDS, **kwargs).execute()
+                        _items.extend(_result.get('items', []))
+                        _page_token = _result.get('nextPageToken')
+                        if _page_token is None:
+                                return _items, _result.get('nextSyncToken')
+
+        def full_sync(self, service):
+                """Replace the local copy by a complete listing of the sync window"""
+                _now = datetime.datetime.fromtimestamp(clock.time(), datetime.timezone.utc)
+                _items, self.sync_token = self._list(service, timeMin=_now.isoformat(),
+                                                                                        timeMax=(_now+self.window).isoformat())
+                self.events = {}
+                self.apply(_items)
+                self.updated_min = _now
+                self.last_full_sync = _now
+
+        def sync(self, service):
+                """Bring the local copy up to date, return the list of changed items"""
+                from googleapiclient.errors import HttpError
+                _now = datetime.datetime.fromtimestamp(clock.time(), datetime.timezone.utc)
+                # the window moves on, so events entering it are picked up by a regular full resync
+                if self.last_full_sync is None or _now - self.last_full_sync > self.window/2:
+                        self.full_sync(service)
+                        return list(self.events.values())
+                try:
+                        if self.sync_token is not None:
+                                _items, _token = self._list(service, syncToken=self.sync_token)
+                        else:
+                                # overlap by a minute to not lose changes made during the last request. 
+                                # No time window, an event moved out of it has to be seen as well, 
+                                # upcoming() drops what has ended
+                                _items, _token = self._list(service, showDeleted=True,
+                                                                                        updatedMin=(self.updated_min-datetime.timedelta(minutes=1)).isoformat())
+                except HttpError as err:
+                        if err.resp.status == 410:
+                                # sync token expired, start over
+                                self.full_sync(service)
+                                return list(self.events.values())
+                        raise
+                if _token is not None:
+                        self.sync_token = _token
+                self.updated_min = _now
+                self.apply(_items)
+                return _items
+
+        def apply(self, items):
+                """Apply inserts, updates and cancellations to the local copy"""
+                for _item in items:
+                        if _item.get('status') == 'cancelled':
+                                self.events.pop(_item['id'], None)
+                        else:
+                                self.events[_item['id']] = event_record.from_item(_item)
+
+        def upcoming(self, number_events):
+                """Return the index of the next number_events events which have not ended yet"""
+                _now = clock.time()
+                for _id, _event in list(self.events.items()):
+                        if _event.end <= _now:
+                                del self.events[_id]
+                return event_index(heapq.nsmallest(number_events, self.events.values(), key=lambda record: record.start))
+
+#
+#============================================================
+class calendar_source():
+        """One monitored calendar (e.g. a meeting room) with its own credentials,
+        language, alert times and audio output sink"""
+        def __init__(self, name, calendar_id, token_file, credentials_file, language, alerts, sink):
+                self.name = name
+                self.calendar_id = calendar_id
+                self.language = language
+                self.alerts = alerts
+                self.sink = sink
+                self.client = get_calendar_client(token_file, credentials_file)
+                self.store = event_store(calendar_id, sync_window_days)
+                self.events = event_index()
+                # time the events were seen changing last
+                self.last_change = None
+
+#
+#============================================================
+def load_calendar_sources():
+        """Build the list of monitored calendars from the "calendars" prefs entry,
+        settings missing in an entry are taken from the global prefs.
+        Calendars which are monitored already (after a reload of the prefs) keep
+        their events, only language, alert times and sink are updated.
+        Returns the calendars which are new"""
+        global calendar_sources
+        _known = dict(((_source.name, _source.calendar_id, _source.client), _source) for _source in calendar_sources)
+        _new = []
+        calendar_sources = []
+        for _calendar in calendars or [{'name': 'primary', 'calendar_id': 'primary'}]:
+                _alerts = alerts
+                _sink = _calendar.get('sink', sinks)
+                if 'alerts' in _calendar:
+                        _alerts = [int(_alert['alert_time']) for _alert in _calendar['alerts']]
+                _name = _calendar.get('name', _calendar['calendar_id'])
+                _token_file = filepath+_calendar.get('token_file', 'token.pickle')
+                _credentials_file = filepath+_calendar.get('credentials_file', 'credentials.json')
+                _source = _known.get((_name, _calendar['calendar_id'], get_calendar_client(_token_file, _credentials_file)))
+                if _source is None:
+                        _source = calendar_source(_name, _calendar['calendar_id'], _token_file, _credentials_file, 
+                                                  _calendar.get('language', language), _alerts, _sink)
+                        _new.append(_source)
                 else:
-                        flow = InstalledAppFlow.from_client_secrets_file(
-                                'credentials.json', SCOPES)
-                        creds = flow.run_local_server(port=0)
-                # Save the credentials for the next run
-                with open('token.pickle', 'wb') as token:
-                        pickle.dump(creds, token)
+                        _source.language = _calendar.get('language', language)
+                        _source.alerts = _alerts
+                        _source.sink = _sink
+                calendar_sources.append(_source)
+        return _new
+
+#
+#============================================================
+def get_events(number_events, source):
+        """Load events from Google Calendar
+        Returns the index of the next number_events events on the calendar, either 
+        from the incrementally synced local copy or by listing the calendar
+        """
+        service = source.client.get_service()
 
-        service = build('calendar', 'v3', credentials=creds)
+        if sync_mode == 'incremental':
+                source.store.sync(service)
+                return source.store.upcoming(number_events)
 
         # Call the Calendar API
-        startlooking = datetime.datetime.utcnow().isoformat() + 'Z' # 'Z' indicates UTC time
+        startlooking = datetime.datetime.fromtimestamp(clock.time(), datetime.timezone.utc).isoformat()
             
-        events_result = service.events().list(calendarId='primary', timeMin=startlooking,
-                                                                                maxResults=number_events, singleEvents=True,
-                                                                                orderBy='startTime').execute()
-        events = events_result.get('items', [])
-        return (events)
-        
+        # the API hands out at most 2500 events per page, follow the pages until we have enough
+        events = []
+        _page_token = None
+        while True:
+                _kwargs = {'pageToken': _page_token} if _page_token is not None else {}
+                get_api_quota().record()
+                events_result = service.events().list(calendarId=source.calendar_id, timeMin=startlooking,
+                                                                                        maxResults=min(number_events-len(events), 2500), singleEvents=True,
+                                                                                        orderBy='startTime', fields=EVENT_FIELDS, **_kwargs).execute()
+                events.extend(events_result.get('items', []))
+                _page_token = events_result.get('nextPageToken')
+                if _page_token is None or len(events) >= number_events:
+                        break
+        return event_index(event_record.from_item(_item) for _item in events[:number_events])
+
+#
+#============================================================
+class event_snapshot():
+        """Durable local snapshot of the calendars in a SQLite file. It is 
+        written after every successful sync and loaded on startup, so alerts
+        can be scheduled right away and keep working while Google is out of reach.
+        The sync state is stored as well, an incremental sync continues where 
+        it left off"""
+        schema_version = '2'
+
+        def __init__(self, path):
+                self.lock = threading.Lock()
+                self.closed = False
+                self.connection = sqlite3.connect(path, check_same_thread=False)
+                with self.connection:
+                        self.connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+                        _row = self.connection.execute("SELECT value FROM meta WHERE key='schema_version'").fetchone()
+                        if _row is None or _row[0] != self.schema_version:
+                                # unknown layout, start from scratch
+                                self.connection.execute('DROP TABLE IF EXISTS calendars')
+                                self.connection.execute('DROP TABLE IF EXISTS events')
+                                self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('schema_version', ?)", (self.schema_version,))
+                        self.connection.execute('CREATE TABLE IF NOT EXISTS calendars (name TEXT PRIMARY KEY, calendar_id TEXT, '
+                                                'sync_token TEXT, updated_min TEXT, last_full_sync TEXT, saved REAL)')
+                        self.connection.execute('CREATE TABLE IF NOT EXISTS events (calendar TEXT, id TEXT, start REAL, end REAL, '
+                                                'summary TEXT, status TEXT, all_day INTEGER, PRIMARY KEY (calendar, id))')
+
+        def save(self, source):
+                """Replace the snapshot of one calendar in a single transaction"""
+                _store = source.store
+                if sync_mode == 'incremental':
+                        _events = list(_store.events.values())
+                else:
+                        _events = list(source.events)
+                _stamp = lambda value: value.isoformat() if value is not None else None
+                with self.lock:
+                        if self.closed:
+                                # a fetch which ended after the program quit
+                                return
+                        with self.connection:
+                                self.connection.execute('DELETE FROM events WHERE calendar=?', (source.name,))
+                                self.connection.executemany('INSERT INTO events VALUES (?, ?, ?, ?, ?, ?, ?)', 
+                                                            [(source.name, _event.id, _event.start, _event.end, _event.summary, 
+                                                              _event.status, _event.all_day) for _event in _events])
+                                self.connection.execute('INSERT OR REPLACE INTO calendars VALUES (?, ?, ?, ?, ?, ?)', 
+                                                        (source.name, source.calendar_id, _store.sync_token, _stamp(_store.updated_min), 
+                                                         _stamp(_store.last_full_sync), clock.time()))
+
+        def load(self, source):
+                """Fill a calendar from the snapshot, return the time it was saved or None"""
+                with self.lock:
+                        _row = self.connection.execute('SELECT calendar_id, sync_token, updated_min, last_full_sync, saved '
+                                                       'FROM calendars WHERE name=?', (source.name,)).fetchone()
+                        if _row is None or _row[0] != source.calendar_id:
+                                return None
+                        _events = [event_record(_id, _start, _end, _summary, _status, bool(_all_day)) 
+                                   for _id, _start, _end, _summary, _status, _all_day in 
+                                   self.connection.execute('SELECT id, start, end, summary, status, all_day '
+                                                           'FROM events WHERE calendar=?', (source.name,))]
+                _store = source.store
+                _parse = lambda value: dateutil.parser.parse(value) if value else None
+                _store.sync_token = _row[1]
+                _store.updated_min = _parse(_row[2])
+                _store.last_full_sync = _parse(_row[3])
+                _store.events = dict((_event.id, _event) for _event in _events)
+                source.events = _store.upcoming(number_events)
+                return _row[4]
+
+        def close(self):
+                """Close the database, a save still running finishes first, 
+                later ones are skipped. Not to be called from a signal handler,
+                the lock might be held by the interrupted thread"""
+                with self.lock:
+                        self.closed = True
+                        self.connection.close()
+
+#
+#============================================================
+def get_snapshot():
+        """Return the calendar snapshot, None if disabled via prefs.json"""
+        global calendar_snapshot
+        if calendar_snapshot is None and snapshot_file:
+                calendar_snapshot = event_snapshot(filepath+snapshot_file)
+        return calendar_snapshot
+
+#
+#============================================================
+def fetch_calendars(sources):
+        """Load the events of all calendars concurrently. Calendars sharing
+        a client (same credentials) are loaded one after the other since 
+        the HTTP connection of a client must not be used by two threads"""
+        _groups = {}
+        for _source in sources:
+                _groups.setdefault(id(_source.client), []).append(_source)
+
+        def _fetch_group(group):
+                for _source in group:
+                        try:
+                                _before = _source.events.signature()
+                                with metrics.timer('calspeech_fetch_seconds', calendar=_source.name):
+                                        _source.events = get_events(number_events, _source)
+                                if _source.events.signature() != _before:
+                                        _source.last_change = clock.time()
+                        except Exception:
+                                metrics.inc('calspeech_refresh_failures_total', calendar=_source.name)
+                                raise
+                        if get_snapshot() is not None:
+                                try:
+                                        get_snapshot().save(_source)
+                                except Exception as err:
+                                        # the fetch itself worked, only the next start has to do without the snapshot
+                                        print('Calendar snapshot could not be written:', err)
+                                        metrics.inc('calspeech_snapshot_failures_total')
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(4, len(_groups))) as _pool:
+                for _future in [_pool.submit(_fetch_group, _group) for _group in _groups.values()]:
+                        # pass on errors of any of the calendars
+                        _future.result()
+
+#
+#============================================================
+def refresh_calendars(sources):
+        """Reload all calendars, a failure keeps the events we have (from the
+        last sync or the snapshot) instead of ending the program.
+        Returns the error or None"""
+        try:
+                fetch_calendars(sources)
+        except Exception as err:
+                print('Calendar refresh failed, continuing with the events known so far:', err)
+                return err
+        return None
+
+#
+#============================================================
+class quota_tracker():
+        """Count the Calendar API requests of the last 24 hours against the 
+        daily budget from prefs.json"""
+        def __init__(self, limit):
+                self.limit = limit
+                self.requests = collections.deque()
+                self.lock = threading.Lock()
+
+        def record(self):
+                metrics.inc('calspeech_api_requests_total')
+                with self.lock:
+                        self.requests.append(clock.time())
+
+        def used(self, now):
+                """Return the number of requests within the last 24 hours"""
+                with self.lock:
+                        while self.requests and self.requests[0] <= now - 86400:
+                                self.requests.popleft()
+                        return len(self.requests)
+
+        def free_again(self, now):
+                """Return when the oldest request drops out of the 24 hours"""
+                with self.lock:
+                        return self.requests[0] + 86400 if self.requests else now
+
+#
+#============================================================
+def get_api_quota():
+        """Return the tracker of the Calendar API requests"""
+        global api_quota
+        if api_quota is None:
+                api_quota = quota_tracker(api_daily_quota)
+        return api_quota
+
+#
+#============================================================
+def rate_limited(err):
+        """Tell whether the Calendar API refused a request because of its rate limits"""
+        from googleapiclient.errors import HttpError
+        if not isinstance(err, HttpError):
+                return False
+        if err.resp.status == 429:
+                return True
+        return err.resp.status == 403 and any(_reason in str(getattr(err, 'content', b'')) 
+                                              for _reason in ('rateLimitExceeded', 'quotaExceeded'))
+
+#
+#============================================================
+class refresh_policy():
+        """Decide when the calendars are fetched next. In adaptive mode they are
+        fetched more often as the next alert approaches (a moved or cancelled 
+        meeting matters most right before it) and right after changes, which 
+        come in bursts, and rarely while the calendar is quiet. Errors back off
+        exponentially, harder on rate limits, and all intervals get some jitter 
+        so several instances do not hit the API in lockstep"""
+        def __init__(self, quota):
+                self.quota = quota
+                self.failures = 0
+
+        def interval(self, now, next_alert, last_change):
+                """Return the seconds to wait after a successful fetch"""
+                if refresh_mode == 'fixed':
+                        return refresh_timer*60
+                _min = refresh_min_minutes*60
+                _interval = refresh_max_minutes*60
+                if next_alert is not None:
+                        _interval = min(_interval, max(_min, (next_alert-now)/3))
+                if last_change is not None:
+                        _interval = min(_interval, max(_min, (now-last_change)/2))
+                return _interval
+
+        def next_refresh(self, now, error=None, next_alert=None, last_change=None):
+                """Return the time of the next fetch after one which ended now"""
+                if error is not None:
+                        self.failures += 1
+                        _backoff = refresh_min_minutes*60 * 2**min(self.failures, 16)
+                        if rate_limited(error):
+                                _backoff *= 4
+                        _backoff = min(_backoff, refresh_max_minutes*60)
+                        # full jitter
+                        return now + random.uniform(_backoff/2, _backoff)
+                self.failures = 0
+                _interval = self.interval(now, next_alert, last_change)
+                _used = self.quota.used(now)
+                if _used >= self.quota.limit:
+                        # out of budget, wait until requests drop out of the last 24 hours
+                        _interval = max(_interval, self.quota.free_again(now) - now)
+                elif _used >= 0.8*self.quota.limit:
+                        _interval = max(_interval, refresh_max_minutes*60)
+                return now + _interval*random.uniform(0.9, 1.1)
+
+#
+#============================================================
+class calendar_fetcher():
+        """Fetch the calendars in a background thread, so a slow or hanging 
+        request (or a login in the browser) never holds up the alerts. The 
+        events of a calendar are built up in its store and published by 
+        swapping in a new event index, the alert path only ever reads a 
+        complete index and never waits for the network.
+        Without thread (replay) a fetch is run right away when it is requested"""
+        def __init__(self, wake, threaded=True):
+                self.wake = wake
+                self.requested = Event()
+                self.done = Event()
+                self.lock = threading.Lock()
+                self.error = None
+                # start of the running fetch, None while idle
+                self.busy_since = None
+                # end of the last successful fetch, the age of the events
+                self.last_success = None
+                if threaded:
+                        self.thread = threading.Thread(target=self._run)
+                        self.thread.daemon = True
+                        self.thread.start()
+                else:
+                        self.thread = None
+
+        def request(self):
+                """Start a fetch of all calendars"""
+                self.busy_since = clock.time()
+                if self.thread is None:
+                        self._fetch()
+                else:
+                        self.requested.set()
+
+        def busy(self):
+                return self.busy_since is not None
+
+        def take(self):
+                """Return (True, error or None) once after a fetch ended, (False, None) otherwise"""
+                if not self.done.is_set():
+                        return False, None
+                self.done.clear()
+                with self.lock:
+                        return True, self.error
+
+        def age(self, now):
+                """Return the seconds since the last successful fetch or None"""
+                if self.last_success is None:
+                        return None
+                return now - self.last_success
+
+        @staticmethod
+        def stale_after():
+                """Return the age in seconds after which the events count as outdated"""
+                if stale_minutes > 0:
+                        return stale_minutes*60
+                if refresh_mode == 'adaptive':
+                        return 2*refresh_max_minutes*60
+                return 2*refresh_timer*60
+
+        def stale(self, now):
+                _age = self.age(now)
+                return _age is None or _age > self.stale_after()
+
+        def _fetch(self):
+                with metrics.timer('calspeech_refresh_seconds'):
+                        _error = refresh_calendars(calendar_sources)
+                with self.lock:
+                        self.error = _error
+                        if _error is None:
+                                self.last_success = clock.time()
+                self.busy_since = None
+                self.done.set()
+                self.wake()
+
+        def _run(self):
+                while not exit.is_set():
+                        self.requested.wait()
+                        self.requested.clear()
+                        self._fetch()
+
+#
+#============================================================
+class tts_cache():
+    """Content addressed on-disk cache for text-to-speech results.
+    Entries are keyed by (text, language, engine), the cache is capped by 
+    total size and by the time an entry was last used, least recently used
+    entries are evicted first"""
+    # seconds an entry is kept after it was used, so it can still be decoded
+    in_use = 30
+
+    def __init__(self, directory, max_bytes, max_age):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, text, lang, engine, extension):
+        _key = hashlib.sha1(u'\0'.join((engine, lang, text)).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, _key + extension)
+
+    def lookup(self, text, lang, engine, extension='.mp3'):
+        """Return the path of the cached sound file or None. Hits and misses
+        are counted once per request by the caller, not per probe"""
+        _path = self._path(text, lang, engine, extension)
+        try:
+            # the modification time doubles as "last used" stamp for the LRU eviction
+            os.utime(_path, None)
+        except OSError:
+            return None
+        return _path
+
+    def fetch(self, text, lang, engine, synthesize, extension='.mp3'):
+        """Return the path of the cached sound file, calling synthesize(path)
+        to create it on a cache miss"""
+        _path = self.lookup(text, lang, engine, extension)
+        if _path is not None:
+            return _path
+        _path = self._path(text, lang, engine, extension)
+        # synthesize into a temp file first and rename it in place, so concurrent
+        # readers never see a half written file
+        _fd, _tmp = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        os.close(_fd)
+        try:
+            synthesize(_tmp)
+            os.replace(_tmp, _path)
+        finally:
+            if os.path.exists(_tmp):
+                os.remove(_tmp)
+        self.evict()
+        return _path
+
+    def evict(self):
+        """Remove entries unused for longer than max_age, then remove the least
+        recently used entries until the cache fits into max_bytes"""
+        with self.lock:
+            _now = time.time()
+            _entries = []
+            for _name in os.listdir(self.directory):
+                if not _name.endswith(('.mp3', '.wav')):
+                    continue
+                _path = os.path.join(self.directory, _name)
+                try:
+                    _stat = os.stat(_path)
+                except OSError:
+                    continue
+                if _now - _stat.st_mtime > self.max_age:
+                    self._remove(_path)
+                else:
+                    _entries.append((_stat.st_mtime, _stat.st_size, _path))
+            _total = sum(_size for _mtime, _size, _path in _entries)
+            for _mtime, _size, _path in sorted(_entries):
+                if _total <= self.max_bytes:
+                    break
+                if _now - _mtime < self.in_use:
+                    # just handed out by lookup or fetch, probably about to be decoded
+                    continue
+                if self._remove(_path):
+                    _total -= _size
+
+    @staticmethod
+    def _remove(path):
+        """Remove an entry, it may be gone already (other process, other thread)"""
+        try:
+            os.remove(path)
+        except OSError:
+            return False
+        return True
+
+#
+#============================================================
+def get_speech_cache():
+    """Return the text-to-speech cache, None if disabled via prefs.json"""
+    global speech_cache
+    if tts_cache_max_mb <= 0:
+        return None
+    if speech_cache is None:
+        speech_cache = tts_cache(filepath+tts_cache_dir, tts_cache_max_mb*1024*1024, tts_cache_max_days*86400)
+    return speech_cache
+
+#
+#============================================================
+class tts_engine():
+    """Base class of the text-to-speech engines, an engine writes the 
+    spoken text into a sound file"""
+    name = ''
+    extension = '.mp3'
+    # seconds a call may take, set by tts_selector
+    timeout = None
+
+    def available(self):
+        return True
+
+    def synthesize(self, text, lang, path):
+        raise NotImplementedError
+
+#
+#============================================================
+class gtts_engine(tts_engine):
+    """Google text-to-speech, needs network access"""
+    name = 'gtts'
+
+    def available(self):
+        # only look for it, importing it is expensive
+        return importlib.util.find_spec('gtts') is not None
+
+    def synthesize(self, text, lang, path):
+        from gtts import gTTS
+        import urllib3
+        # disable warnings we might get from text to speech module
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+        # the HTTP requests give up with the time budget as well, a call which timed out
+        # does not keep its worker busy for the socket default
+        _tts = gTTS(text = text, lang = lang, slow = False, timeout = self.timeout)
+        _tts.save(path)
+
+#
+#============================================================
+class espeak_engine(tts_engine):
+    """espeak-ng (or espeak) command line synthesizer, works offline"""
+    name = 'espeak'
+    extension = '.wav'
+
+    def _command(self):
+        return shutil.which('espeak-ng') or shutil.which('espeak')
+
+    def available(self):
+        return self._command() is not None
+
+    def synthesize(self, text, lang, path):
+        subprocess.check_call([self._command(), '-v', lang, '-w', path, text], 
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+#
+#============================================================
+class pyttsx3_engine(tts_engine):
+    """pyttsx3 using the speech synthesizer of the operating system, works offline"""
+    name = 'pyttsx3'
+    extension = '.wav'
+
+    def __init__(self):
+        self.engine = None
+        self.lock = threading.Lock()
+
+    def available(self):
+        # only look for it, importing it is expensive
+        return importlib.util.find_spec('pyttsx3') is not None
+
+    def synthesize(self, text, lang, path):
+        import pyttsx3
+        # the pyttsx3 engine is not thread safe and expensive to set up
+        with self.lock:
+            if self.engine is None:
+                self.engine = pyttsx3.init()
+            for _voice in self.engine.getProperty('voices'):
+                if lang in str(_voice.languages) or lang in _voice.id:
+                    self.engine.setProperty('voice', _voice.id)
+                    break
+            self.engine.save_to_file(text, path)
+            self.engine.runAndWait()
+
+#
+#============================================================
+class cache_only_engine(tts_engine):
+    """Serves earlier results of any other engine from the text-to-speech
+    cache, never synthesizes anything itself"""
+    name = 'cache'
+
+    def __init__(self, engines):
+        self.engines = engines
+
+    def find(self, text, lang):
+        """Return the path of a cached result of any engine or None"""
+        _cache = get_speech_cache()
+        if _cache is None:
+            return None
+        for _engine in self.engines:
+            _path = _cache.lookup(text, lang, _engine.name, _engine.extension)
+            if _path is not None:
+                return _path
+        return None
+
+    def synthesize(self, text, lang, path):
+        raise LookupError('not in text-to-speech cache: ' + text)
+
+#
+#============================================================
+class tts_selector():
+    """Pick the text-to-speech engine for every request. Each engine gets
+    a time budget, a slow or failing engine is left behind and the next one
+    is tried. The latency of every engine is tracked (moving average), 
+    engines which are too slow or failed recently are moved to the back"""
+    # seconds a failed or too slow engine stays at the back of the line
+    cooldown = 300
+    # calls of one engine running at the same time, timed out ones included
+    max_workers = 2
+
+    def __init__(self, names, timeout):
+        _engines = {'gtts': gtts_engine(), 'espeak': espeak_engine(), 'pyttsx3': pyttsx3_engine()}
+        self.engines = [_engines[_name] for _name in names if _name in _engines and _engines[_name].available()]
+        for _engine in _engines.values():
+            _engine.timeout = timeout
+        self.cache_engine = cache_only_engine(list(_engines.values())) if 'cache' in names else None
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        # per engine, so hanging online engines can not keep the offline ones from being tried
+        self.workers = dict((_engine.name, threading.BoundedSemaphore(self.max_workers)) for _engine in self.engines)
+        self.stats = dict((_engine.name, {'latency': None, 'calls': 0, 'failures': 0, 'timeouts': 0, 'penalty_until': 0}) 
+                          for _engine in self.engines)
+
+    def _record(self, engine, latency=None, failed=False, timed_out=False):
+        with self.lock:
+            _stats = self.stats[engine.name]
+            _stats['calls'] += 1
+            if latency is not None:
+                _stats['latency'] = latency if _stats['latency'] is None else 0.8*_stats['latency'] + 0.2*latency
+            if failed or timed_out:
+                _stats['failures' if failed else 'timeouts'] += 1
+                _stats['penalty_until'] = time.time() + self.cooldown
+
+    def ranked(self):
+        """Return the engines in the order to try them"""
+        _now = time.time()
+        with self.lock:
+            def _rank(engine):
+                _stats = self.stats[engine.name]
+                _slow = _stats['latency'] is not None and _stats['latency'] > self.timeout
+                return _stats['penalty_until'] > _now or _slow
+            # sorted() is stable, so the preference order of prefs.json is kept otherwise
+            return sorted(self.engines, key=_rank)
+
+    def _synthesize(self, engine, text, lang):
+        """Synthesize and decode with one engine, via the cache if enabled.
+        Returns the segment and whether it came from the cache"""
+        from pydub import AudioSegment
+        _cache = get_speech_cache()
+        if _cache is not None:
+            _path = _cache.lookup(text, lang, engine.name, engine.extension)
+            if _path is not None:
+                return AudioSegment.from_file(_path), True
+            return AudioSegment.from_file(_cache.fetch(text, lang, engine.name, 
+                                                      lambda path: engine.synthesize(text, lang, path), engine.extension)), False
+        _fd, _path = tempfile.mkstemp(suffix=engine.extension, dir=filepath or '.')
+        os.close(_fd)
+        try:
+            engine.synthesize(text, lang, _path)
+            return AudioSegment.from_file(_path), False
+        finally:
+            os.remove(_path)
+
+    def cached(self, text, lang):
+        """Return True if segment() would find the text in the cache"""
+        if self.cache_engine is not None and self.cache_engine.find(text, lang) is not None:
+            return True
+        _cache = get_speech_cache()
+        return _cache is not None and any(_cache.lookup(text, lang, _engine.name, _engine.extension) is not None 
+                                          for _engine in self.ranked()[:1])
+
+    @staticmethod
+    def _count_cache(hit):
+        """Count one cache hit or miss per request, if the cache is enabled"""
+        if get_speech_cache() is not None:
+            metrics.inc('calspeech_tts_cache_hits_total' if hit else 'calspeech_tts_cache_misses_total')
+
+    def segment(self, text, lang):
+        """Return the spoken text as decoded sound"""
+        from pydub import AudioSegment
+        if self.cache_engine is not None:
+            # repeated phrases are played from the cache without a network round trip,
+            # no matter which engine produced them
+            _path = self.cache_engine.find(text, lang)
+            if _path is not None:
+                self._count_cache(True)
+                return AudioSegment.from_file(_path)
+        _refused = resources.refused()
+        if _refused is not None:
+            self._count_cache(False)
+            metrics.inc('calspeech_work_refused_total', work='tts')
+            raise LookupError('text-to-speech refused, ' + _refused)
+        _error = LookupError('no text-to-speech engine available')
+        for _engine in self.ranked():
+            if not self.workers[_engine.name].acquire(blocking=False):
+                # the workers of this engine are stuck in calls which timed out, do not pile up more threads
+                metrics.inc('calspeech_work_refused_total', work='tts')
+                _error = LookupError(_engine.name + ': all workers are busy')
+                continue
+            _result = {}
+            _started = time.time()
+
+            def _run(engine=_engine, result=_result):
+                try:
+                    result['segment'], result['cached'] = self._synthesize(engine, text, lang)
+                except Exception as err:
+                    result['error'] = err
+                finally:
+                    self.workers[engine.name].release()
+            # a timed out engine keeps running in the background and may still fill the cache
+            _thread = threading.Thread(target=_run)
+            _thread.daemon = True
+            _thread.start()
+            _thread.join(self.timeout)
+            if _thread.is_alive():
+                self._record(_engine, timed_out=True)
+                metrics.inc('calspeech_tts_failures_total', engine=_engine.name, reason='timeout')
+                _error = LookupError(_engine.name + ' timed out')
+            elif 'error' in _result:
+                self._record(_engine, failed=True)
+                metrics.inc('calspeech_tts_failures_total', engine=_engine.name, reason='error')
+                _error = _result['error']
+            else:
+                self._record(_engine, latency=time.time()-_started)
+                metrics.observe('calspeech_tts_seconds', time.time()-_started, engine=_engine.name)
+                self._count_cache(_result['cached'])
+                return _result['segment']
+        self._count_cache(False)
+        raise _error
+
+#
+#============================================================
+def get_tts():
+    """Return the text-to-speech engine selector"""
+    global tts
+    if tts is None:
+        tts = tts_selector(tts_engines, tts_timeout)
+    return tts
+
+#
+#============================================================
+class sound_assets():
+    """Registry of the static sound files (silence, gong, startup sound).
+    Every file is decoded once on first use and kept in memory as PCM, 
+    it is only decoded again if the file on disk changes"""
+    def __init__(self):
+        self.segments = {}
+        self.prefixes = {}
+        self.lock = threading.Lock()
+
+    def get(self, sound_file):
+        """Return the decoded sound file or None if there is no such file"""
+        _path = filepath+sound_file
+        if not os.path.isfile(_path):
+            return None
+        _stat = os.stat(_path)
+        _version = (_stat.st_mtime, _stat.st_size)
+        with self.lock:
+            _entry = self.segments.get(_path)
+            if _entry is not None and _entry[0] == _version:
+                return _entry[1]
+        from pydub import AudioSegment
+        _segment = AudioSegment.from_mp3(_path)
+        with self.lock:
+            self.segments[_path] = (_version, _segment)
+        return _segment
+
+    def prefix(self, alert_sound):
+        """Return silence and alert sound pre-concatenated as the lead-in of every alert"""
+        _parts = [self.get(silence_file)]
+        if alert_sound:
+            _parts.append(self.get(str_alert_sound_file))
+        _parts = tuple(_part for _part in _parts if _part is not None)
+        # the concatenation is rebuilt whenever one of the decoded parts was replaced
+        _key = tuple(id(_part) for _part in _parts)
+        with self.lock:
+            _entry = self.prefixes.get(alert_sound)
+            if _entry is not None and _entry[0] == _key:
+                return _entry[1]
+        from pydub import AudioSegment
+        _segment = AudioSegment.empty()
+        for _part in _parts:
+            _segment += _part
+        with self.lock:
+            self.prefixes[alert_sound] = (_key, _segment)
+        return _segment
+
+global assets
+assets = sound_assets()
+
 #
 #============================================================
 
-def _play_with_ffplay_suppress(seg):
-    """ Play mp3 files without console output
-    modified clone of original pydub code"""
+def get_pcm_player(seg, sink=''):
+    """Return the command line of a player reading raw or streamed WAV PCM
+    in the format of the given segment from stdin, and whether it expects a 
+    WAV header. sink selects the output device, empty for the default one"""
+    from pydub.utils import get_player_name
     PLAYER = get_player_name()
-    # create temporary mp3 file for audio output since "with NamedTemporaryFile("w+b", suffix=".mp3") as f:"
-    # as used in original pydub code comes up with double back slash errors in Windows
-    if os.path.exists(filepath+'.'+path_delim):
-        with open(filepath+'.'+path_delim+str_play_sound_file, 'wb') as f:
-            seg.export(f.name, "mp3")
-            devnull = open(os.devnull, 'w')
-            subprocess.call([PLAYER, "-nodisp", "-autoexit", "-hide_banner", f.name], stdout=devnull, stderr=devnull)
+    if shutil.which(PLAYER):
+        # ffplay / avplay: a WAV header with unknown length lets it play the stream as it arrives,
+        # the output device is passed via the AUDIODEV environment variable (SDL)
+        return [PLAYER, "-nodisp", "-autoexit", "-hide_banner", "-loglevel", "quiet", "-i", "pipe:0"], True
+    if shutil.which('aplay'):
+        _device = ['-D', sink] if sink else []
+        return ['aplay', '-q', '-t', 'raw', '-f', 'S16_LE', '-r', str(seg.frame_rate), '-c', str(seg.channels)] + _device, False
+    if shutil.which('paplay'):
+        _device = ['--device='+sink] if sink else []
+        return ['paplay', '--raw', '--format=s16le', '--rate='+str(seg.frame_rate), '--channels='+str(seg.channels)] + _device, False
+    # let subprocess come up with a proper error message
+    return [PLAYER, "-nodisp", "-autoexit", "-hide_banner", "-loglevel", "quiet", "-i", "pipe:0"], True
+
+#
+#============================================================
+def _wav_stream_header(seg):
+    """WAV header with unknown (maximum) length for streaming 16 bit PCM"""
+    _block_align = seg.channels * 2
+    return (b'RIFF' + struct.pack('<I', 0xFFFFFFFF) + b'WAVEfmt ' +
+            struct.pack('<IHHIIHH', 16, 1, seg.channels, seg.frame_rate, seg.frame_rate*_block_align, _block_align, 16) +
+            b'data' + struct.pack('<I', 0xFFFFFFFF))
+
+#
+#============================================================
+class output_sink():
+    """One audio output. lead_in is the silence (seconds) the device needs
+    before it plays, e.g. an HDMI receiver switching its input, latency the
+    time (seconds) from our pipe to its speaker, e.g. a network speaker"""
+    def __init__(self, device='', lead_in=0.0, latency=0.0):
+        self.device = device
+        self.lead_in = lead_in
+        self.latency = latency
+
+#
+#============================================================
+def output_sinks(sink):
+    """Return the outputs of a "sink" setting, either a device name or a
+    list of outputs with "device", "lead_in_ms" and "latency_ms". Raises on 
+    entries it can not make sense of"""
+    if not sink:
+        return [output_sink()]
+    if isinstance(sink, str):
+        return [output_sink(sink)]
+    return [output_sink(_output.get('device', ''), int(_output.get('lead_in_ms', 0))/1000, 
+                        int(_output.get('latency_ms', 0))/1000) for _output in sink]
+
+#
+#============================================================
+# seconds a player may run beyond the end of its sound before it counts as hung and is killed
+PLAYER_GRACE = 15
+
+#
+#============================================================
+def _play_with_ffplay_suppress(seg, tail=None, sink=''):
+    """ Play sound without console output by piping raw PCM to the 
+    player's stdin, no mp3 re-encoding and no temp files involved.
+    An optional tail callable returning a further segment is evaluated 
+    while the first segment is already playing.
+    sink is a device name or a list of outputs (see output_sinks), all of
+    them are fed concurrently from the same PCM buffer. Every output gets 
+    at least its lead-in silence, outputs with less latency get more, so 
+    that all of them play in sync"""
+    _started = time.time()
+    _result = {}
+    if tail is not None:
+        if len(seg) == 0:
+            # nothing to play in the meantime, so the tail defines the format
+            seg, tail = tail(), None
+        else:
+            def _render_tail():
+                try:
+                    _tail = tail().set_frame_rate(seg.frame_rate).set_channels(seg.channels).set_sample_width(2)
+                    _result['data'] = memoryview(_tail.raw_data)
+                except Exception as err:
+                    _result['error'] = err
+            _tail_thread = threading.Thread(target=_render_tail)
+            _tail_thread.start()
+    seg = seg.set_sample_width(2)
+    # one buffer for all outputs, they only get slices of it
+    _data = memoryview(seg.raw_data)
+    # write in chunks of 100 ms so that the player starts while we are still writing
+    _chunk = int(seg.frame_rate * 0.1) * seg.frame_width
+    _outputs = output_sinks(sink)
+    _start = max(_output.lead_in + _output.latency for _output in _outputs)
+
+    def _feed(output, first):
+        global playback_latency
+        _command, _wav_header = get_pcm_player(seg, output.device)
+        _env = None
+        if output.device:
+            _env = dict(os.environ, AUDIODEV=output.device)
+        _player = subprocess.Popen(_command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=_env)
+        # a player which hangs (e.g. audio device gone) is killed once it is well past the end of the sound
+        _watchdog = []
+        def _arm(seconds):
+            for _timer in _watchdog:
+                _timer.cancel()
+            del _watchdog[:]
+            if seconds is not None:
+                _timer = threading.Timer(seconds + PLAYER_GRACE, _kill)
+                _timer.daemon = True
+                _timer.start()
+                _watchdog.append(_timer)
+        def _kill():
+            if _player.poll() is None:
+                print('Player hangs, killed:', _command[0])
+                metrics.inc('calspeech_player_kills_total')
+                _player.kill()
+        _arm(_start + len(seg)/1000)
+        try:
+            if _wav_header:
+                _player.stdin.write(_wav_stream_header(seg))
+            _silence = int(seg.frame_rate * (_start - output.latency)) * seg.frame_width
+            if _silence:
+                _player.stdin.write(bytes(_silence))
+            for _offset in range(0, len(_data), _chunk):
+                _player.stdin.write(_data[_offset:_offset+_chunk])
+                if _offset == 0 and first:
+                    _player.stdin.flush()
+                    # time to first sample, as seen from our side of the pipe
+                    playback_latency = time.time() - _started
+                    metrics.observe('calspeech_first_sample_seconds', playback_latency)
+            if tail is not None:
+                # rendering the tail may take a while, the player just waits for it
+                _arm(None)
+                _tail_thread.join()
+                if 'error' in _result:
+                    raise _result['error']
+                _tail = _result['data']
+                _arm(_start + (len(_data) + len(_tail))/seg.frame_rate/seg.frame_width)
+                for _offset in range(0, len(_tail), _chunk):
+                    _player.stdin.write(_tail[_offset:_offset+_chunk])
+            _player.stdin.close()
+        except BrokenPipeError:
+            # player gone, nothing left to do
+            pass
+        finally:
+            if not _watchdog:
+                # given up on the tail, the player still gets to finish what it has
+                _arm(_start + len(seg)/1000)
+            try:
+                _player.stdin.close()
+            except OSError:
+                pass
+            _player.wait()
+            _arm(None)
+
+    _errors = []
+    def _feed_other(output):
+        try:
+            _feed(output, False)
+        except Exception as err:
+            _errors.append(err)
+    _threads = [threading.Thread(target=_feed_other, args=(_output,)) for _output in _outputs[1:]]
+    for _thread in _threads:
+        _thread.start()
+    try:
+        _feed(_outputs[0], True)
+    finally:
+        for _thread in _threads:
+            _thread.join()
+        metrics.observe('calspeech_playback_seconds', time.time() - _started)
+    if _errors:
+        raise _errors[0]
+
+#
+#============================================================                
+def alert_parts(summary, minutes, lang=None):
+    """Split the spoken alert text for an event starting in the given minutes
+    into the meeting subject and the "begins in N minutes" tail, in the given 
+    language or the global one"""
+    _strings = locale_packs.get(lang, {})
+    _begins = _strings.get('str_begins', str_begins)
+    if minutes == 1:
+        return summary, _begins + _strings.get('str_one_minute', str_one_minute)
+    return summary, _begins + str(minutes) + _strings.get('str_minutes', str_minutes)
+
+#
+#============================================================                
+def alert_text(summary, minutes, lang=None):
+    """Build the spoken alert text for an event starting in the given minutes,
+    in the given language or the global one"""
+    return ''.join(alert_parts(summary, minutes, lang))
+
+#
+#============================================================                
+def speech_segment(speak_text, speak_lang):
+    """ Convert text to speech and return the decoded result"""
+    return get_tts().segment(speak_text, speak_lang)
 
 #
 #============================================================                
-def speak_string(speak_text, speak_lang, alert_sound):
-    """ Convert text to speech and trigger audio output
+class fragment_cache():
+    """Decoded speech of the parts alerts are put together from, the meeting 
+    subjects and the "begins in N minutes" tails. The least recently used 
+    parts are dropped beyond max_entries"""
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.segments = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def segment(self, text, lang):
+        """Return the decoded speech of a part, synthesized on first use"""
+        _key = (text, lang)
+        with self.lock:
+            _segment = self.segments.get(_key)
+            if _segment is not None:
+                self.segments.move_to_end(_key)
+        if _segment is not None:
+            metrics.inc('calspeech_fragment_hits_total')
+            return _segment
+        metrics.inc('calspeech_fragment_misses_total')
+        _segment = speech_segment(text, lang)
+        with self.lock:
+            self.segments[_key] = _segment
+            while len(self.segments) > self.max_entries:
+                self.segments.popitem(last=False)
+        return _segment
+
+    def cached(self, text, lang):
+        """Return True if the part is available without a text-to-speech engine"""
+        with self.lock:
+            if (text, lang) in self.segments:
+                return True
+        return get_tts().cached(text, lang)
+
+    def clear(self):
+        """Throw away all parts, e.g. after the text-to-speech engines were changed"""
+        with self.lock:
+            self.segments = collections.OrderedDict()
+
+global fragments
+fragments = fragment_cache()
+
+# milliseconds the subject and the tail of an alert overlap when they are joined
+FRAGMENT_CROSSFADE_MS = 30
+# pause between alerts merged into one announcement
+ALERT_PAUSE_MS = 400
+
+#
+#============================================================                
+def alert_speech(alerts, lang):
+    """Return the decoded speech of a list of (summary, minutes) alerts in a
+    language like "en_US". With speech_fragments on it is joined from the 
+    cached parts, otherwise the whole text is synthesized at once"""
+    #"language" is a 5 character locale string like "en_US". Text-to-speech only needs e.g."en"
+    if not speech_fragments:
+        return speech_segment('. '.join(alert_text(_summary, _minutes, lang) for _summary, _minutes in alerts), lang[:2])
+    from pydub import AudioSegment
+    _speech = None
+    for _summary, _minutes in alerts:
+        _subject, _tail = [fragments.segment(_text, lang[:2]) for _text in alert_parts(_summary, _minutes, lang)]
+        _segment = _subject.append(_tail, crossfade=min(FRAGMENT_CROSSFADE_MS, len(_subject), len(_tail)))
+        if _speech is not None:
+            _segment = _speech + AudioSegment.silent(ALERT_PAUSE_MS, _speech.frame_rate) + _segment
+        _speech = _segment
+    return _speech
+
+#
+#============================================================                
+def speech_cached(alerts, lang):
+    """Return True if the speech of a list of (summary, minutes) alerts can
+    be put together without waiting for a text-to-speech engine"""
+    if speech_fragments:
+        return all(fragments.cached(_text, lang[:2]) for _summary, _minutes in alerts 
+                   for _text in alert_parts(_summary, _minutes, lang))
+    return get_tts().cached('. '.join(alert_text(_summary, _minutes, lang) for _summary, _minutes in alerts), lang[:2])
+
+#
+#============================================================                
+def render_alerts(alerts, lang, alert_sound):
+    """ Build the complete output clip of a list of (summary, minutes) alerts
     with optional leading alert sound (gong etc)"""
-    
-    _tts = gTTS(text = speak_text, lang = speak_lang, slow = False)
-    _tts.save(filepath+str_tts_sound_file)
-    # build output sound file
-    _sound_segment = AudioSegment.empty()
-
-    # add silence to the beginning, might be needed in same scenarios with sound output via HDMI
-    # controlled by "silence_file" entry in prefs.json
-    if os.path.isfile(filepath+silence_file):
-        _sound_segment += AudioSegment.from_mp3(filepath+silence_file)
-        
-    if alert_sound:
-        # if there is a gong or alike (prefs.json) defined then add the sound to the output
-        _sound_segment += AudioSegment.from_mp3(filepath+str_alert_sound_file)
-    # add converted string    
-    _sound_segment += AudioSegment.from_mp3(filepath+str_tts_sound_file)
-    # crank it out ...
-    _play_with_ffplay_suppress(_sound_segment)
+    # build output sound file: silence to the beginning, might be needed in same scenarios with sound
+    # output via HDMI (controlled by "silence_file" entry in prefs.json), followed by the gong or alike
+    # if defined in prefs.json. Both are kept decoded and pre-concatenated by the asset registry,
+    # only the speech needs to be rendered
+    with metrics.timer('calspeech_render_seconds'):
+        return assets.prefix(alert_sound) + alert_speech(alerts, lang)
+
+#
+#============================================================                
+def speak_alerts(alerts, lang, alert_sound, sink=''):
+    """ Convert a list of (summary, minutes) alerts to speech and trigger 
+    audio output with optional leading alert sound (gong etc)"""
+    if speech_cached(alerts, lang):
+        # crank it out ... the lead-in already plays while the cached speech is decoded
+        _play_with_ffplay_suppress(assets.prefix(alert_sound), lambda: alert_speech(alerts, lang), sink)
+    else:
+        # synthesizing may take up to tts_timeout per engine, the player would run dry after 
+        # the gong and the silence for the HDMI wake-up would be used up before the speech
+        try:
+            _speech = alert_speech(alerts, lang)
+        except Exception:
+            # no engine (offline, refused past a resource ceiling), at least play the gong
+            if alert_sound:
+                _play_with_ffplay_suppress(assets.prefix(alert_sound), None, sink)
+            raise
+        _play_with_ffplay_suppress(assets.prefix(alert_sound) + _speech, None, sink)
+
+#
+#============================================================                
+class prerender_cache():
+    """Render the alert clips which are going to fire before the next calendar
+    refresh in a background thread, so that at alert time only playback is left.
+    Clips of events which were moved or deleted are thrown away.
+    Without thread (replay) nothing is rendered, every alert is a miss"""
+    # decoded clips kept in memory, about a MB each
+    max_clips = 64
+
+    def __init__(self, threaded=True):
+        self.clips = {}
+        self.lock = threading.Lock()
+        self.pending = Event()
+        self.sources = []
+        self.horizon = 0
+        if threaded:
+            self.thread = threading.Thread(target=self._run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    @staticmethod
+    def signature(event):
+        """Identify the version of an event, a moved or renamed event gets a new signature"""
+        return (event.start, event.summary)
+
+    def update(self, sources, horizon):
+        """Hand over the freshly loaded calendars, clips are rendered for all 
+        alerts firing within the next horizon seconds"""
+        with self.lock:
+            self.sources = [(_source, _source.events) for _source in sources]
+            self.horizon = horizon
+        self.pending.set()
+
+    def clear(self):
+        """Throw away all clips, e.g. after the language or the sounds were changed"""
+        with self.lock:
+            self.clips = {}
+
+    def take(self, source, event, alert_time):
+        """Return the pre-rendered clip for this alert or None"""
+        with self.lock:
+            _entry = self.clips.pop((source.name, event.id, alert_time), None)
+        if _entry is not None and _entry[0] == self.signature(event):
+            metrics.inc('calspeech_prerender_hits_total')
+            return _entry[1]
+        metrics.inc('calspeech_prerender_misses_total')
+        return None
+
+    def _due_alerts(self, sources, horizon):
+        """Work out all (source, event, alert_time) triples firing within the horizon"""
+        _now = clock.time()
+        _due = []
+        for _source, _events in sources:
+            if not _source.alerts:
+                continue
+            # only the events which can have an alert within the horizon
+            for _event in _events.between(_now - 60 + min(_source.alerts)*60, _now + horizon + max(_source.alerts)*60):
+                if _event.all_day:
+                    continue
+                for _alert_time in _source.alerts:
+                    # the scheduler fires exactly alert_time minutes before the start
+                    if _now - 60 < _event.start - _alert_time*60 < _now + horizon:
+                        _due.append((_source, _event, _alert_time))
+        return _due
+
+    def _run(self):
+        while not exit.is_set():
+            self.pending.wait()
+            self.pending.clear()
+            with self.lock:
+                _sources = self.sources
+                _horizon = self.horizon
+            if resources.refused() is not None:
+                # the alerts are rendered when they are due, or play the gong only
+                metrics.inc('calspeech_work_refused_total', work='prerender')
+                continue
+            if speech_fragments:
+                # the "begins in N minutes" parts are shared by all meetings, so every
+                # alert of any meeting only needs its subject synthesized
+                for _language, _alert_time in set((_source.language, _alert_time) for _source, _events in _sources 
+                                                  for _alert_time in _source.alerts):
+                    try:
+                        fragments.segment(alert_parts('', _alert_time, _language)[1], _language[:2])
+                    except Exception:
+                        break
+            # the earliest alerts first, the clips held in memory are limited
+            _due = sorted(self._due_alerts(_sources, _horizon), 
+                          key=lambda due: due[1].start - due[2]*60)[:self.max_clips]
+            _wanted = dict(((_source.name, _event.id, _alert_time), self.signature(_event)) 
+                           for _source, _event, _alert_time in _due)
+            # throw away clips of moved, renamed or deleted events
+            with self.lock:
+                for _key in list(self.clips):
+                    if _wanted.get(_key) != self.clips[_key][0]:
+                        del self.clips[_key]
+            for _source, _event, _alert_time in _due:
+                _key = (_source.name, _event.id, _alert_time)
+                with self.lock:
+                    if _key in self.clips or self.pending.is_set():
+                        continue
+                try:
+                    _clip = render_alerts([(_event.summary, _alert_time)], _source.language, alert_sound)
+                except Exception:
+                    # no network etc., the alert falls back to rendering at fire time
+                    continue
+                with self.lock:
+                    self.clips[_key] = (self.signature(_event), _clip)
+
+#
+#============================================================
+class alert_scheduler():
+    """Keep the exact fire time of every (event, alert time) pair in a 
+    priority queue, so the main loop can sleep until the next deadline.
+    Every alert fires exactly once, an alert which is overdue by more
+    than grace seconds (e.g. after a suspend) is skipped and counted as missed"""
+    def __init__(self, grace=60):
+        self.grace = grace
+        self.heap = []
+        self.entries = {}
+        self.fired = {}
+        self.missed = 0
+        self.sequence = itertools.count()
+
+    def update(self, sources):
+        """Recompute the deadlines from the fresh event lists of all calendars, 
+        only new or moved alerts are pushed, entries of moved or deleted events
+        become stale"""
+        _entries = {}
+        _now = clock.time()
+        for _source in sources:
+            # events which started more than grace seconds ago have no alerts left
+            for _event in _source.events.between(_now - self.grace):
+                if _event.all_day:
+                    continue
+                for _alert_time in _source.alerts:
+                    _entries[(_source.name, _event.id, _alert_time)] = (_event.start - _alert_time*60, _source, _event)
+        # a moved event gets a new fire time and is announced again. Fired alerts are
+        # remembered until they are over, also for events which dropped out of the
+        # next number_events for a moment, so they do not fire twice when they come back
+        self.fired = dict((_key, _fire) for _key, _fire in self.fired.items() 
+                          if _fire >= _now - self.grace or (_key in _entries and _entries[_key][0] == _fire))
+        for _key, (_fire, _source, _event) in _entries.items():
+            _old = self.entries.get(_key)
+            if _old is None or _old[0] != _fire:
+                if _fire < _now - self.grace:
+                    # was already over when we learned about it, nothing missed
+                    self.fired[_key] = _fire
+                else:
+                    heapq.heappush(self.heap, (_fire, next(self.sequence), _key))
+        self.entries = _entries
+
+    def _stale(self, fire, key):
+        _entry = self.entries.get(key)
+        return _entry is None or _entry[0] != fire or self.fired.get(key) == fire
+
+    def next_deadline(self):
+        """Return the timestamp of the next alert or None"""
+        while self.heap and self._stale(self.heap[0][0], self.heap[0][2]):
+            heapq.heappop(self.heap)
+        if self.heap:
+            return self.heap[0][0]
+        return None
+
+    def pop_due(self, now, window=0):
+        """Return the list of (source, event, alert_time, fire time) which are due.
+        Alerts due within window seconds after the first one are handed over 
+        with it, so the audio worker can merge them into one announcement"""
+        _due = []
+        _limit = now
+        while self.heap and self.heap[0][0] <= _limit:
+            _fire, _seq, _key = heapq.heappop(self.heap)
+            if self._stale(_fire, _key):
+                continue
+            self.fired[_key] = _fire
+            if now - _fire > self.grace:
+                self.missed += 1
+                metrics.inc('calspeech_alerts_missed_total', reason='overdue')
+                continue
+            _due.append((self.entries[_key][1], self.entries[_key][2], _key[2], _fire))
+            if len(_due) == 1:
+                _limit = max(now, _fire + window)
+        return _due
+
+#
+#============================================================
+class announcement():
+    """One pending audio output: an alert of a calendar event, or a plain
+    sound clip (startup sound) if there is no event"""
+    def __init__(self, due, source=None, event=None, alert_time=None, clip=None):
+        self.due = due
+        self.source = source
+        self.event = event
+        self.alert_time = alert_time
+        self.clip = clip
+        self.sink = source.sink if source is not None else ''
+        self.language = source.language if source is not None else language
+
+    def text(self):
+        return alert_text(self.event.summary, self.alert_time, self.language)
+
+#
+#============================================================
+class audio_worker():
+    """The one thread producing audio output. Announcements are taken from 
+    a bounded priority queue (earliest due first) and played strictly one 
+    after the other. Announcements for the same sink and language which are
+    due within the coalescing window are merged into one utterance with a 
+    single gong (the scheduler hands such alerts over together, see 
+    alert_scheduler.pop_due), announcements which are stale by the time they reach the 
+    front of the queue are dropped"""
+    def __init__(self, max_queue=16, window=10, stale_after=60, threaded=True):
+        self.max_queue = max_queue
+        self.window = window
+        self.stale_after = stale_after
+        self.queue = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.dropped = 0
+        self.stale = 0
+        if threaded:
+            self.thread = threading.Thread(target=self._run)
+            self.thread.daemon = True
+            self.thread.start()
 
+    def submit(self, items):
+        """Queue a batch of announcements at once so simultaneous alerts can be merged"""
+        with self.condition:
+            for _item in items:
+                if len(self.queue) >= self.max_queue:
+                    self.dropped += 1
+                    metrics.inc('calspeech_alerts_missed_total', reason='queue_full')
+                    continue
+                heapq.heappush(self.queue, (_item.due, next(self.sequence), _item))
+            self.condition.notify()
+
+    def pop_group(self):
+        """Take the next announcement and everything to be merged with it 
+        off the queue, None if the queue is empty"""
+        with self.condition:
+            if not self.queue:
+                return None
+            _first = heapq.heappop(self.queue)[2]
+            _group = [_first]
+            _others = []
+            while self.queue and self.queue[0][0] <= _first.due + self.window:
+                _entry = heapq.heappop(self.queue)
+                _item = _entry[2]
+                if _first.event is not None and _item.event is not None and \
+                        _item.sink == _first.sink and _item.language == _first.language:
+                    _group.append(_item)
+                else:
+                    _others.append(_entry)
+            for _entry in _others:
+                heapq.heappush(self.queue, _entry)
+        return _group
+
+    def _next_group(self):
+        """Wait for the next announcement and collect everything to be merged with it"""
+        with self.condition:
+            while not self.queue:
+                self.condition.wait()
+            return self.pop_group()
+
+    def fresh(self, group, now):
+        """Drop the announcements of a group which are stale by now, the others
+        are counted as played"""
+        _fresh = [_item for _item in group if now - _item.due <= self.stale_after]
+        self.stale += len(group) - len(_fresh)
+        metrics.inc('calspeech_alerts_missed_total', len(group) - len(_fresh), reason='stale')
+        for _item in _fresh:
+            if _item.event is not None:
+                # how late the alert starts playing compared to its scheduled time
+                metrics.observe('calspeech_alert_lateness_seconds', max(0, now - _item.due))
+                metrics.inc('calspeech_alerts_played_total')
+        return _fresh
+
+    def _play(self, group):
+        _first = group[0]
+        if len(group) == 1 and _first.clip is not None:
+            _play_with_ffplay_suppress(_first.clip, None, _first.sink)
+        else:
+            speak_alerts([(_item.event.summary, _item.alert_time) for _item in group], _first.language, alert_sound, _first.sink)
+
+    def _run(self):
+        while not exit.is_set():
+            _fresh = self.fresh(self._next_group(), clock.time())
+            if not _fresh:
+                continue
+            try:
+                self._play(_fresh)
+            except Exception as err:
+                # keep the worker alive, the next alert might work again (network back etc.)
+                print('Audio output failed:', err)
+
+#
+#============================================================
+def announce(due, audio, prerendered):
+    """Hand the due alerts over to the audio worker, using the clips rendered
+    in the background so only playback is left on the critical path"""
+    audio.submit([announcement(_fire, source, event, alert_time, 
+                               prerendered.take(source, event, alert_time) if prerendered is not None else None)
+                  for source, event, alert_time, _fire in due])
+
+#
+#============================================================
+class alert_loop():
+    """One pass of the main loop: fire the due alerts, fetch the calendars 
+    when the refresh policy says so (or give up on a hanging fetch), take 
+    over fetched events, plan the next refresh and the clips to prerender,
+    and tell when the events are outdated. It only goes by clock, main() 
+    runs it in real time and replay() on the virtual clock"""
+    def __init__(self, scheduler, audio, prerendered, fetcher):
+        self.scheduler = scheduler
+        self.audio = audio
+        self.prerendered = prerendered
+        self.fetcher = fetcher
+        # when to fetch the calendars next, adapted to the upcoming alerts, changes and errors
+        self.policy = refresh_policy(get_api_quota())
+        # the first pass starts a fetch, the policy plans the next ones
+        self.next_refresh = clock.time()
+        self.stale = fetcher.stale(clock.time())
+        # fetches taken over and the time of the last successful one, for the status screen
+        self.stints = 1
+        self.last = datetime.datetime.now()
+
+    def step(self):
+        """Run one pass, return True if fetched events were taken over"""
+        _now = clock.time()
+
+        # Once we have reached one of the alert times, play alert via sound & text-to-speech 
+        announce(self.scheduler.pop_due(_now, self.audio.window), self.audio, self.prerendered)
+
+        # reload calendar when the refresh policy says so
+        if _now >= self.next_refresh:
+            if not self.fetcher.busy():
+                self.fetcher.request()
+                self.next_refresh = _now + fetch_timeout
+            elif _now - self.fetcher.busy_since >= fetch_timeout:
+                # the fetch hangs, go on with the events we have and plan the next one as after an error
+                print('Calendar fetch takes longer than', fetch_timeout, 'seconds, continuing with the events known so far')
+                metrics.inc('calspeech_fetch_timeouts_total')
+                self.next_refresh = self.policy.next_refresh(_now, TimeoutError('calendar fetch timed out'))
+            else:
+                self.next_refresh = self.fetcher.busy_since + fetch_timeout
+
+        _refreshed, _error = self.fetcher.take()
+        if _refreshed:
+            self.stints = self.stints + 1
+            self.scheduler.update(calendar_sources)
+            # alerts which became due while we were loading are fired right away
+            announce(self.scheduler.pop_due(clock.time(), self.audio.window), self.audio, self.prerendered)
+            _last_change = max([_source.last_change for _source in calendar_sources if _source.last_change is not None], default=None)
+            self.next_refresh = self.policy.next_refresh(clock.time(), _error, self.scheduler.next_deadline(), _last_change)
+            # clips for all alerts due before the next refresh
+            self.prerendered.update(calendar_sources, self.next_refresh - clock.time() + 60)
+            if _error is None:
+                self.last = datetime.datetime.now()
+
+        # tell when the alerts are based on outdated events, e.g. Google can not be reached
+        _age = self.fetcher.age(clock.time())
+        if _age is not None:
+            metrics.gauge('calspeech_data_age_seconds', round(_age, 1))
+        if self.fetcher.stale(clock.time()) != self.stale:
+            self.stale = not self.stale
+            _message = '%s %s' % (str_data_age, '-' if _age is None else int(_age/60))
+            if self.stale:
+                _message = _message + '  ' + str_stale
+            print(_message)
+            notify_service_manager('STATUS=' + _message)
+        return _refreshed
+
+    def next_wake(self):
+        """Return when the next pass is due: next alert, refresh or the events getting outdated"""
+        _wake = self.next_refresh
+        if self.scheduler.next_deadline() is not None:
+            _wake = min(_wake, self.scheduler.next_deadline())
+        if not self.stale and self.fetcher.last_success is not None:
+            _wake = min(_wake, self.fetcher.last_success + self.fetcher.stale_after() + 1)
+        return _wake
+
+#
+#============================================================
+# settings which change the rendered alert clips
+CLIP_SETTINGS = set(('language', 'locale_packs', 'str_begins', 'str_minutes', 'str_one_minute', 'alerts', 
+                     'alert_sound', 'str_alert_sound_file', 'silence_file', 'tts_engines', 'calendars', 
+                     'speech_fragments'))
+
+#
+#============================================================
+def apply_prefs_changes(changed, prerendered, scheduler, horizon):
+    """Invalidate only what depends on the changed settings after a reload 
+    of prefs.json, clips are rendered for the alerts within the next horizon 
+    seconds. Returns True if the calendars have to be fetched again"""
+    global tts
+    global speech_cache
+    global calendar_snapshot
+    if not changed:
+        return False
+    print('Prefs reloaded, changed:', ', '.join(sorted(changed)))
+    # a fetch right away also plans the next one by the new refresh settings
+    _refetch = bool(changed & set(('sync_mode', 'sync_window_days', 'refresh_mode', 'refresh_timer', 
+                                   'refresh_min_minutes', 'refresh_max_minutes')))
+    if 'api_daily_quota' in changed:
+        get_api_quota().limit = api_daily_quota
+    if changed & set(('tts_engines', 'tts_timeout')):
+        tts = None
+    if changed & set(('tts_cache_dir', 'tts_cache_max_mb', 'tts_cache_max_days')):
+        speech_cache = None
+    if 'snapshot_file' in changed:
+        calendar_snapshot = None
+    if 'language' in changed:
+        try:
+            locale.setlocale(locale.LC_TIME, language+'.utf-8')
+        except locale.Error as err:
+            print(err)
+    if changed & set(('silence_file', 'str_alert_sound_file', 'alert_sound')):
+        # decode the new sounds now and not when the next alert is due
+        assets.prefix(alert_sound)
+    if 'metrics_file' in changed:
+        metrics.enabled = metrics.enabled or bool(metrics_file)
+    if 'metrics_port' in changed:
+        print('metrics_port takes effect after a restart')
+    if changed & set(('calendars', 'alerts', 'language', 'sinks')):
+        for _source in load_calendar_sources():
+            # a calendar added to the prefs, start from the snapshot until it is fetched
+            _refetch = True
+            if get_snapshot() is not None:
+                get_snapshot().load(_source)
+    if 'sync_window_days' in changed:
+        for _source in calendar_sources:
+            # picked up by the next sync of the fetch thread
+            _source.store.window = datetime.timedelta(days=sync_window_days)
+            _source.store.last_full_sync = None
+    if 'fetch_timeout' in changed:
+        # rebuilt with the new timeout on the next fetch
+        for _client in list(calendar_clients.values()):
+            _client.service = None
+    if 'number_events' in changed:
+        # the stores belong to the fetch thread, with a sync token this is a cheap request
+        _refetch = True
+    if changed & CLIP_SETTINGS:
+        prerendered.clear()
+        fragments.clear()
+    prerendered.update(calendar_sources, horizon)
+    scheduler.update(calendar_sources)
+    return _refetch
 
 #
 #============================================================
@@ -421,6 +2659,87 @@ def check_keyboard_input(exit):
                     wrapup_and_quit()
             exit.wait(0.5)
 
+#
+#============================================================
+class event_loop():
+    """Blocking wait of the main loop for the next deadline, a self-pipe
+    (written by signals and by other threads via wake()) and stdin if it 
+    is interactive. Between those the process makes no wakeups at all.
+    Windows can not select on pipes, there an Event is waited for instead"""
+    def __init__(self, interactive):
+        self.interactive = interactive
+        self.wakeup = Event()
+        self.selector = None
+        if isWindows:
+            return
+        self.selector = selectors.DefaultSelector()
+        self.read_fd, self.write_fd = os.pipe()
+        os.set_blocking(self.read_fd, False)
+        os.set_blocking(self.write_fd, False)
+        self.selector.register(self.read_fd, selectors.EVENT_READ)
+        # a signal arriving while we are blocked in select() writes to the pipe
+        signal.set_wakeup_fd(self.write_fd)
+        if interactive:
+            self.selector.register(sys.stdin.fileno(), selectors.EVENT_READ)
+
+    def wake(self):
+        """Wake up the main loop, can be called from any thread"""
+        if self.selector is None:
+            self.wakeup.set()
+            return
+        try:
+            os.write(self.write_fd, b'\0')
+        except (BlockingIOError, OSError):
+            # pipe full, the loop is going to wake up anyway
+            pass
+
+    def wait(self, timeout):
+        """Block until timeout, a wakeup or input, return the typed characters"""
+        if self.selector is None:
+            self.wakeup.wait(timeout)
+            self.wakeup.clear()
+            return ''
+        _typed = ''
+        for _key, _mask in self.selector.select(timeout):
+            if _key.fd == self.read_fd:
+                try:
+                    while os.read(self.read_fd, 512):
+                        pass
+                except BlockingIOError:
+                    pass
+            else:
+                try:
+                    _data = os.read(_key.fd, 32)
+                except OSError as err:
+                    # EIO after a terminal hangup
+                    print('Keyboard input not available:', err)
+                    _data = b''
+                if not _data:
+                    # end of input (terminal closed, </dev/null), it would be reported readable 
+                    # forever, go on with the timers and signals only
+                    self.selector.unregister(_key.fd)
+                    self.interactive = False
+                _typed += _data.decode('utf-8', 'replace')
+        return _typed
+
+#
+#============================================================
+def notify_service_manager(state):
+    """Send a state like "READY=1" to systemd if started with Type=notify"""
+    _address = os.environ.get('NOTIFY_SOCKET')
+    if not _address:
+        return
+    if _address.startswith('@'):
+        # abstract namespace socket
+        _address = '\0' + _address[1:]
+    _sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        _sock.sendto(state.encode('utf-8'), _address)
+    except OSError:
+        pass
+    finally:
+        _sock.close()
+
 #
 #============================================================
 def print_usage():
@@ -428,7 +2747,322 @@ def print_usage():
     print('Usage:')
     print(os.path.basename(str(sys.argv[0])), ' or')
     print(os.path.basename(str(sys.argv[0])), '[-h|--help] or ')
-    print(os.path.basename(str(sys.argv[0])), '[[-d|--dir <base directory>]')
+    print(os.path.basename(str(sys.argv[0])), '[-d|--dir <base directory>] [-D|--daemon] [--pidfile <file>]')
+    print('  -D, --daemon: run without terminal, no keyboard input and no status screen')
+    print('  --pidfile: write the process id to this file')
+    print(os.path.basename(str(sys.argv[0])), '[-d|--dir <base directory>] --check')
+    print('  --check: check prefs, credentials and sound files without network access or sound output')
+    print(os.path.basename(str(sys.argv[0])), '[-d|--dir <base directory>] --replay <file|synthetic> [--replay-days <days>] [--replay-start <YYYY-MM-DD>]')
+    print('  --replay: run the alerts of a recorded or the synthetic calendar on a virtual clock without sound output')
+#
+#============================================================
+def preflight_check(prefs_file):
+    """Check prefs, credentials and sound files without network access or 
+    sound output (--check), print the findings and return the exit code"""
+    _errors = []
+    def _report(level, message):
+        print('%-5s %s' % (level, message))
+        if level == 'ERROR':
+            _errors.append(message)
+
+    _import = import_seconds
+    _report('OK' if _import <= IMPORT_BUDGET else 'WARN', 'import took %d ms (budget %d ms)' % (_import*1000, IMPORT_BUDGET*1000))
+    try:
+        apply_config(read_prefs(prefs_file, current_settings()))
+        _report('OK', prefs_file)
+    except (EnvironmentError, ValueError, KeyError, TypeError) as err:
+        _report('ERROR', '%s: %s' % (prefs_file, err))
+        return 1
+
+    # only look for the modules, importing them would eat up the import budget
+    for _module in ['googleapiclient', 'google_auth_oauthlib', 'httplib2', 'pydub']:
+        _report('OK' if importlib.util.find_spec(_module) else 'ERROR', 'module: %s' % _module)
+    if 'gtts' in tts_engines:
+        _report('OK' if importlib.util.find_spec('gtts') else 'WARN', 'module: gtts')
+
+    for _calendar in calendars or [{'name': 'primary', 'calendar_id': 'primary'}]:
+        _client = calendar_client(filepath+_calendar.get('token_file', 'token.pickle'), 
+                                  filepath+_calendar.get('credentials_file', 'credentials.json'))
+        try:
+            _usable, _message = _client.check()
+            _report('OK' if _usable else 'WARN', '%s: %s' % (_calendar.get('name', _calendar['calendar_id']), _message))
+        except Exception as err:
+            _report('ERROR', '%s: %s' % (_calendar.get('name', _calendar['calendar_id']), err))
+
+    _sounds = [str_initial_sound_file]
+    if alert_sound:
+        _sounds.append(str_alert_sound_file)
+    if silence_file:
+        _sounds.append(silence_file)
+    for _sound in _sounds:
+        _report('OK' if os.path.isfile(filepath+_sound) else 'ERROR', filepath+_sound)
+    # pydub decodes with ffmpeg, the players are looked up like get_pcm_player does
+    _decoder = shutil.which('ffmpeg') or shutil.which('avconv')
+    _report('OK' if _decoder else 'ERROR', 'decoder: %s' % (_decoder or 'neither ffmpeg nor avconv found'))
+    _player = shutil.which('ffplay') or shutil.which('avplay') or shutil.which('aplay') or shutil.which('paplay')
+    _report('OK' if _player else 'ERROR', 'player: %s' % (_player or 'none of ffplay, avplay, aplay, paplay found'))
+
+    _engines = tts_selector(tts_engines, tts_timeout).engines
+    _report('OK' if _engines else 'ERROR', 'text-to-speech: %s' % (', '.join(_engine.name for _engine in _engines) or 'no engine available'))
+
+    if snapshot_file and os.path.isfile(filepath+snapshot_file):
+        try:
+            _connection = sqlite3.connect('file:%s?mode=ro' % (filepath+snapshot_file), uri=True)
+            try:
+                _count = _connection.execute('SELECT COUNT(*) FROM events').fetchone()[0]
+            finally:
+                _connection.close()
+            _report('OK', '%s: %d events' % (filepath+snapshot_file, _count))
+        except sqlite3.Error as err:
+            _report('WARN', '%s: %s, is rebuilt on the next fetch' % (filepath+snapshot_file, err))
+    return 1 if _errors else 0
+
+#
+#============================================================
+class replay_service():
+    """Stand-in for the Calendar API serving a recorded or synthetic calendar
+    on the virtual clock of the replay mode. Edits become visible at their 
+    time, a sync token is the virtual time of the request it came from"""
+    def __init__(self, items, edits):
+        self.items = {}
+        self.records = {}
+        for _item in items:
+            self._put(_item)
+        self.edits = sorted(edits, key=lambda edit: edit[0])
+        self.edit_times = [_at for _at, _item in self.edits]
+        self.applied = 0
+        self.requests = 0
+
+    def _put(self, item):
+        self.items[item['id']] = item
+        self.records[item['id']] = event_record.from_item(item)
+
+    def advance(self, now):
+        """Apply the edits made up to now"""
+        while self.applied < len(self.edits) and self.edits[self.applied][0] <= now:
+            self._put(self.edits[self.applied][1])
+            self.applied += 1
+
+    def next_edit(self):
+        """Return the time of the next edit or None"""
+        if self.applied < len(self.edits):
+            return self.edits[self.applied][0]
+        return None
+
+    def events(self):
+        return self
+
+    def list(self, **kwargs):
+        _now = clock.time()
+        self.advance(_now)
+        self.requests += 1
+        if 'syncToken' in kwargs:
+            # everything edited since the last request, the latest version of each event
+            _changed = self.edits[bisect.bisect_right(self.edit_times, float(kwargs['syncToken'])):self.applied]
+            _items = list(dict((_item['id'], _item) for _at, _item in _changed).values())
+        else:
+            _begin = dateutil.parser.parse(kwargs['timeMin']).timestamp()
+            _end = dateutil.parser.parse(kwargs['timeMax']).timestamp() if 'timeMax' in kwargs else float('inf')
+            _items = [self.items[_id] for _id, _record in self.records.items() 
+                      if _record.status != 'cancelled' and _record.end > _begin and _record.start < _end]
+            if 'orderBy' in kwargs:
+                _items = sorted(_items, key=lambda item: self.records[item['id']].start)[:kwargs['maxResults']]
+        _result = {'items': _items, 'nextSyncToken': repr(_now)}
+        return types.SimpleNamespace(execute=lambda: _result)
+
+#
+#============================================================
+# the null sink of the replay mode takes as long as the gong plus the spoken text
+REPLAY_GONG_SECONDS = 2.0
+REPLAY_SECONDS_PER_CHAR = 0.07
+# alerts starting to play later than this are reported as late
+REPLAY_LATE_SECONDS = 5
+# what the synthetic calendar of the replay mode is made of
+REPLAY_SUMMARIES = ('Standup', 'Design review', 'One on one', 'Sprint planning', 'Customer call', 
+                    'Lunch', 'Interview', 'Budget meeting', 'Retrospective', 'Team sync')
+
+#
+#============================================================
+def synthetic_calendar(start, days, seed=1):
+    """Build a calendar for the replay mode: busy days in Europe/Berlin with
+    overlapping meetings, all-day events and meetings in the night of the 
+    DST switch, plus edits (moves, renames, cancellations) made while the 
+    replay runs. Returns the items and the (time, item) edits"""
+    import dateutil.tz
+    _zone = dateutil.tz.gettz('Europe/Berlin')
+    _random = random.Random(seed)
+    _items = []
+    _edits = []
+    _first = datetime.datetime.fromtimestamp(start, _zone).date()
+    for _n in range(days + 1):
+        _day = _first + datetime.timedelta(days=_n)
+        if _random.random() < 0.2:
+            _items.append({'id': 'day%d' % _n, 'summary': 'Conference', 'status': 'confirmed', 
+                           'start': {'date': _day.isoformat()}, 'end': {'date': (_day + datetime.timedelta(days=1)).isoformat()}})
+        _slots = [datetime.time(_random.randrange(8, 18), _random.choice((0, 15, 30, 45))) 
+                  for _i in range(_random.randrange(2, 5) if _day.weekday() >= 5 else _random.randrange(6, 15))]
+        if _day.weekday() == 6:
+            # the DST switch happens on a Sunday night between 2 and 3 o'clock
+            _slots.append(datetime.time(2, 30))
+        for _i, _slot in enumerate(_slots):
+            _begin = datetime.datetime.combine(_day, _slot, _zone)
+            _item = {'id': 'ev%dx%d' % (_n, _i), 'summary': _random.choice(REPLAY_SUMMARIES), 'status': 'confirmed',
+                     'start': {'dateTime': _begin.isoformat()}, 
+                     'end': {'dateTime': (_begin + datetime.timedelta(minutes=_random.choice((15, 30, 60, 90)))).isoformat()}}
+            if _random.random() < 0.15:
+                # edited some time during the two days before the meeting
+                _at = _begin.timestamp() - _random.uniform(60, 2*86400)
+                _edited = dict(_item)
+                _kind = _random.choice(('move', 'rename', 'cancel'))
+                if _kind == 'move':
+                    _shift = datetime.timedelta(minutes=_random.choice((-60, -30, -15, 15, 30, 60, 120)))
+                    _edited['start'] = {'dateTime': (_begin + _shift).isoformat()}
+                    _edited['end'] = {'dateTime': (dateutil.parser.parse(_item['end']['dateTime']) + _shift).isoformat()}
+                elif _kind == 'rename':
+                    _edited['summary'] = _item['summary'] + ' (moved room)'
+                else:
+                    _edited['status'] = 'cancelled'
+                if _at <= start:
+                    _item = _edited
+                else:
+                    _edits.append((_at, _edited))
+            _items.append(_item)
+    return _items, _edits
+
+#
+#============================================================
+def recorded_calendar(path):
+    """Read a calendar for the replay mode from a JSON file with "items" 
+    (events as returned by the Calendar API) and "edits" (each with "at", 
+    an ISO time, and the changed "item")"""
+    with open(path, encoding='utf-8') as f:
+        _recorded = json.load(f)
+    if isinstance(_recorded, list):
+        _recorded = {'items': _recorded}
+    return _recorded['items'], [(dateutil.parser.parse(_edit['at']).timestamp(), _edit['item']) 
+                                for _edit in _recorded.get('edits', [])]
+
+#
+#============================================================
+def expected_alerts(service, alert_times, begin, end):
+    """Return the set of (event id, alert time, fire time) which should be 
+    announced between begin and end, from the version of each event which 
+    is in the calendar when its alert is due. The service must not have 
+    been advanced yet"""
+    _versions = {}
+    for _item in service.items.values():
+        _versions[_item['id']] = [(float('-inf'), _item)]
+    for _at, _item in service.edits:
+        _versions.setdefault(_item['id'], []).append((_at, _item))
+    _expected = set()
+    for _id, _history in _versions.items():
+        for _n, (_from, _item) in enumerate(_history):
+            _until = _history[_n+1][0] if _n+1 < len(_history) else float('inf')
+            _record = event_record.from_item(_item)
+            if _record.status == 'cancelled' or _record.all_day:
+                continue
+            for _alert_time in alert_times:
+                _fire = _record.start - _alert_time*60
+                if max(_from, begin) <= _fire < min(_until, end):
+                    _expected.add((_id, _alert_time, _fire))
+    return _expected
+
+#
+#============================================================
+def replay(calendar, days, start=None):
+    """Run the scheduling and announcement pipeline on a virtual clock 
+    against a recorded calendar file or the synthetic calendar, with a null 
+    audio sink, and report fired, missed and late alerts.
+    The clock jumps from one deadline (alert, refresh, edit, end of playback)
+    to the next, so weeks of alerts take seconds. Returns the exit code"""
+    global clock
+    global calendar_sources
+    global snapshot_file
+    global calendar_snapshot
+    # the snapshot of the real calendars is left alone
+    snapshot_file = ''
+    calendar_snapshot = None
+    random.seed(0)
+    _started = time.perf_counter()
+    if calendar == 'synthetic':
+        if start is None:
+            start = datetime.datetime.combine(date.today(), datetime.time()).timestamp()
+        _items, _edits = synthetic_calendar(start, days)
+    else:
+        _items, _edits = recorded_calendar(calendar)
+        if start is None:
+            # from the midnight before the first event
+            _first = min(event_start(_item) for _item in _items).astimezone()
+            start = datetime.datetime.combine(_first.date(), datetime.time()).timestamp()
+    _end = start + days*86400
+    # the same service (the edits are applied while the time goes by) is used for the ground truth
+    _original = replay_service(_items, _edits)
+    service = replay_service(_items, _edits)
+    clock = virtual_clock(start)
+
+    _source = calendar_source('replay', 'replay', '<replay>', '<replay>', language, alerts, '')
+    _source.client = types.SimpleNamespace(get_service=lambda: service)
+    calendar_sources = [_source]
+    scheduler = alert_scheduler()
+    audio = audio_worker(threaded=False)
+    # the same pass as in main(), the fetches run right away on the virtual clock
+    pipeline = alert_loop(scheduler, audio, prerender_cache(threaded=False), calendar_fetcher(lambda: None, threaded=False))
+    busy_until = start
+    played = []
+    while clock.time() < _end:
+        _now = clock.time()
+        service.advance(_now)
+        pipeline.step()
+        # the null sink: playback takes the time of a gong plus the spoken text
+        while busy_until <= _now:
+            _group = audio.pop_group()
+            if _group is None:
+                break
+            _fresh = audio.fresh(_group, _now)
+            for _item in _fresh:
+                played.append((_item, _now))
+            if _fresh:
+                busy_until = _now + REPLAY_GONG_SECONDS + REPLAY_SECONDS_PER_CHAR*len('. '.join(_item.text() for _item in _fresh))
+        _wake = [pipeline.next_wake(), _end]
+        if service.next_edit() is not None:
+            _wake.append(service.next_edit())
+        if audio.queue:
+            _wake.append(busy_until)
+        clock.advance(min(_wake))
+    _wall = time.perf_counter() - _started
+    clock = system_clock()
+
+    _expected = expected_alerts(_original, alerts, start, _end)
+    _fired = {}
+    for _item, _at in played:
+        _fired.setdefault((_item.event.id, _item.alert_time, _item.due), _at)
+    # alerts merged with an earlier one start a little early, that is not late
+    _on_time = [max(0.0, _fired[_key] - _key[2]) for _key in _expected if _key in _fired]
+    _missed = sorted(_expected - set(_fired), key=lambda key: key[2])
+    _outdated = sorted(set(_fired) - _expected, key=lambda key: key[2])
+    _late = sorted(_on_time)
+
+    def _percentile(fraction):
+        return _late[min(len(_late)-1, int(fraction*len(_late)))] if _late else 0.0
+
+    _format = '%Y-%m-%d %H:%M'
+    print('Replay of %s, %d days from %s: %d events, %d edits' % 
+          (calendar, days, time.strftime(_format, time.localtime(start)), len(_items), len(_edits)))
+    print('  %.0f simulated hours in %.2f s (%.0fx real time), %d calendar requests' % 
+          ((_end-start)/3600, _wall, (_end-start)/max(_wall, 1e-9), service.requests))
+    print('  expected alerts: %d' % len(_expected))
+    print('  fired:           %d' % len(_on_time))
+    print('  late (> %d s):    %d, lateness p50 %.1f s, p99 %.1f s, max %.1f s' % 
+          (REPLAY_LATE_SECONDS, len([_l for _l in _late if _l > REPLAY_LATE_SECONDS]), 
+           _percentile(0.5), _percentile(0.99), _late[-1] if _late else 0.0))
+    print('  missed:          %d (overdue %d, stale in queue %d, queue full %d)' % 
+          (len(_missed), scheduler.missed, audio.stale, audio.dropped))
+    print('  outdated:        %d (announced for a time the event no longer had)' % len(_outdated))
+    for _label, _keys in (('missed', _missed), ('outdated', _outdated)):
+        for _id, _alert_time, _fire in _keys[:5]:
+            print('    %s: %s, %d minutes before, due %s' % (_label, _id, _alert_time, time.strftime(_format, time.localtime(_fire))))
+    return 0
+
 #
 #============================================================
 def main(argv):
@@ -437,13 +3071,10 @@ def main(argv):
 		
     # operating system specific settings
     global path_delim
-    global str_clear
     if platform.system() == 'Windows':
         path_delim = '\\'
-        str_clear = 'cls'
     else:
         path_delim = '/'
-        str_clear = 'clear'
     
     global filepath
     filepath = ''
@@ -451,11 +3082,21 @@ def main(argv):
     #just to have some strings in place
     load_defaults()
 
+    global status_output
+    global loop
+    daemon = False
+    pidfile = None
+    check = False
+    replay_calendar = None
+    replay_days = 30
+    replay_start = None
+
     # TODO: input parameters evauation as function
     # if argument given we expect help as argument or the working directory as an option
     if len(sys.argv) > 1:
         try:
-            opts, args = getopt.getopt(argv, "hd:", ["help", "dir="])
+            opts, args = getopt.getopt(argv, "hd:D", ["help", "dir=", "daemon", "pidfile=", "check", 
+                                                      "replay=", "replay-days=", "replay-start="])
         except getopt.GetoptError:
             print_usage()
             sys.exit(2)
@@ -465,8 +3106,22 @@ def main(argv):
                 sys.exit()
             elif opt in ("-d", "--dir"):
                 filepath = arg+path_delim
+            elif opt in ("-D", "--daemon"):
+                daemon = True
+            elif opt == "--pidfile":
+                pidfile = arg
+            elif opt == "--check":
+                check = True
+            elif opt == "--replay":
+                replay_calendar = arg
+            elif opt == "--replay-days":
+                replay_days = int(arg)
+            elif opt == "--replay-start":
+                replay_start = datetime.datetime.combine(date.fromisoformat(arg), datetime.time()).timestamp()
         
-        if not Path(filepath).is_dir():
+        if filepath == '':
+            pass
+        elif not Path(filepath).is_dir():
             print(filepath, str_nodir)
             sys.exit(2)
         elif not Path(filepath+path_delim+'prefs.json').is_file():
@@ -475,110 +3130,202 @@ def main(argv):
                 
     # load preferences from prefs.json
     prefsfile = filepath+'.'+path_delim+'prefs.json'            
+    if check:
+        sys.exit(preflight_check(prefsfile))
     get_prefs(prefsfile)
+    if replay_calendar is not None:
+        sys.exit(replay(replay_calendar, replay_days, replay_start))
+
+    if daemon:
+        # no terminal to draw on
+        status_output = False
+        # stdout is a pipe to the journal, block buffered it would show up in chunks of 8 kB
+        if hasattr(sys.stdout, 'reconfigure'):
+            sys.stdout.reconfigure(line_buffering=True)
+    if pidfile is not None:
+        with open(pidfile, 'w') as f:
+            f.write(str(os.getpid()) + '\n')
+
+    # set up the text-to-speech cache
+    get_speech_cache()
+    get_tts()
 
     locale.setlocale(locale.LC_TIME, language+'.utf-8')
-    # disable warnings we might get from text to speech module
-    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
     # 
-    # startup sound
-    if status_output:
-        clear_screen()
-        music = AudioSegment.empty()
-    
-        # add silence to the beginning, might be necessary in same scenarios with sound output via HDMI or Bluetooth where sync time is needed
-        if os.path.isfile(filepath+silence_file):
-            music += AudioSegment.from_mp3(filepath+silence_file)
-            
-        music += AudioSegment.from_mp3(filepath+str_initial_sound_file)
-        threading.Thread(target=_play_with_ffplay_suppress, args=(music,)).start()
+    # stage latencies, alert lateness, missed alerts etc. only cost something if anybody looks at them
+    metrics.enabled = bool(metrics_port or metrics_file)
+    if metrics_port:
+        metrics.serve(metrics_port)
+    # all sound output goes through one worker thread, one announcement after the other
+    audio = audio_worker()
+    def _decode_sounds():
+        # decoding takes a while on small machines, the status screen does not wait for it
+        try:
+            if status_output:
+                # startup sound
+                # add silence to the beginning, might be necessary in same scenarios with sound output via HDMI or Bluetooth where sync time is needed
+                music = assets.prefix(False) + assets.get(str_initial_sound_file)
+                audio.submit([announcement(clock.time(), clip=music)])
+            # decode the alert sounds before the first alert needs them
+            assets.prefix(alert_sound)
+        except Exception as err:
+            print('Sound files could not be decoded:', err)
+    _decoder = threading.Thread(target=_decode_sounds)
+    _decoder.daemon = True
+    _decoder.start()
     #
-    events = get_events(number_events)
+    # all calendars are served by this one process, fetched concurrently
+    load_calendar_sources()
+    # start from the local snapshot, the calendars are reconciled in the background below
+    _saved = []
+    if get_snapshot() is not None:
+        for source in calendar_sources:
+            _saved.append(get_snapshot().load(source))
+    # render the clips for the alerts due before the next refresh in the background
+    prerendered = prerender_cache()
+    prerendered.update(calendar_sources, (refresh_timer+1)*60)
 
-    counter = 0
-    stints = 1
+    # exact fire times of all alerts, the loop sleeps until the next one is due
+    scheduler = alert_scheduler()
+    scheduler.update(calendar_sources)
 
-    #
-    last = dateutil.parser.parse(datetime.datetime.now().isoformat())
+    def _report_startup():
+        # time from starting the process to scheduled alerts
+        _seconds = time.perf_counter() - import_started
+        metrics.gauge('calspeech_startup_seconds', round(_seconds, 3))
+        _next = scheduler.next_deadline()
+        print('Alerts scheduled %d ms after start (import %d ms), next alert: %s' % 
+              (_seconds*1000, import_seconds*1000, time.strftime('%H:%M:%S', time.localtime(_next)) if _next is not None else '-'))
+    # without a snapshot the alerts are known after the first fetch
+    startup_reported = any(len(source.events) for source in calendar_sources)
+    if startup_reported:
+        _report_startup()
 
-    # start thread to check keyboard input in background
-    threading.Thread(target=check_keyboard_input, args=(exit,)).start()
+    next_status = clock.time()
+    next_metrics = clock.time()
+
+    # keyboard input is only read if there is someone typing
+    interactive = not daemon and sys.stdin.isatty()
+    if interactive and isWindows:
+        # start thread to check keyboard input in background
+        threading.Thread(target=check_keyboard_input, args=(exit,)).start()
+    poller = key_poller() if interactive and not isWindows else contextlib.nullcontext()
+    
+    loop = event_loop(interactive)
+    # a daemon is told about changes by SIGHUP (systemctl reload), it should not wake up every few seconds
+    prefs_watch = prefs_watcher(prefsfile, None if daemon else 5)
+
+    # all fetching happens in the background, alerts are already scheduled from the snapshot
+    fetcher = calendar_fetcher(loop.wake)
+    if _saved and None not in _saved:
+        fetcher.last_success = min(_saved)
+    pipeline = alert_loop(scheduler, audio, prerendered, fetcher)
+    renderer = status_renderer()
+    if status_output:
+        renderer.capture()
+    notify_service_manager('READY=1')
     
     # loop, waiting for keyboard interrupt or exit character pressed
-    while not exit.is_set():
-
-        # we need to be able to subtract the time stamps, hence we need to force both to the same format    
-        now = dateutil.parser.parse(datetime.datetime.now().isoformat())
-
-        if status_output:
-            clear_screen()
-            print(str_lookahead, number_events)
-            print(str_divider)
-            if not events :
-                print(str_no_event)
-
-        #
-        # go through our event list
-        # it is somewhat redundant to scan the entire list if the parameters "number_events" and "refresh_timer"
-        # create a too wide angle, but it leaves more control via parameters this way and the code is simpler
-        #
-        for event in events:
-            # get the event start time
-            start = event['start'].get('dateTime')
-            
-            # get event description
-            summary = event.get('summary')
-            
-            # we need to be able to subtract the time stamps, hence we need to force naive (time zone un-aware) representation
-            dtu = dateutil.parser.parse(start).replace(tzinfo=None)
-            
-            # time difference between now and event in minutes
-            timeDiff=int(((dtu-now).total_seconds())/60)
-            
-            if status_output:
-                print(summary, ' ', str_begins,' ', timeDiff,str_minutes)
-
-            # Once we have encountered one of the alert times, play alert via sound & text-to-speech 
-            for alert_time in alerts:
-                if timeDiff == alert_time:
-                    if timeDiff == 1:
-                        #"language" is a 5 character locale string like "en_US". Text-to-speech only needs e.g."en", so we do 
-                        # language[:2] to get the first two characters
-                        threading.Thread(target=speak_string, args=(summary + str_begins + str_one_minute, language[:2], alert_sound)).start()
-                    else:
-                        threading.Thread(target=speak_string, args=(summary + str_begins + str(timeDiff) + str_minutes, language[:2], alert_sound)).start()
+    with poller:
+        while not exit.is_set():
 
-        if status_output:
-            print(str_divider)
-            print(str_iteration, ' ', counter+1, '     ', str_stints, stints)
+            _now = clock.time()
+            if pipeline.step() and not startup_reported:
+                startup_reported = True
+                _report_startup()
 
-            print(str_reloaded, ' ', last.strftime("%H:%M:%S %a, %d-%b-%Y"))
-            print(str_exit_msg, str_exit_chars)
+            if status_output and _now >= next_status:
+                now = datetime.datetime.fromtimestamp(clock.time()).astimezone()
+                _lines = [str_lookahead + str(number_events), str_divider]
+                # the indices are sorted already, merge them lazily up to the events shown
+                _events = list(itertools.islice(heapq.merge(*[zip(source.events, itertools.repeat(source)) for source in calendar_sources], 
+                                                            key=lambda e: e[0].start), number_events))
+                if not _events :
+                    _lines.append(str_no_event)
+                for event, source in _events:
+                    # time difference between now and event, down to the second on a terminal
+                    _seconds = int(event.start - now.timestamp())
+                    if renderer.tty:
+                        timeDiff = '%d:%02d' % (_seconds//60, _seconds%60) if _seconds >= 0 else '-%d:%02d' % (-_seconds//60, -_seconds%60)
+                    else:
+                        timeDiff = str(int(_seconds/60))
+                    if event.all_day:
+                        _line = '%s  %s' % (event.summary, str_all_day)
+                    else:
+                        _line = '%s  %s %s %s' % (event.summary, str_begins, timeDiff, str_minutes)
+                    if len(calendar_sources) > 1:
+                        _line = source.name + ': ' + _line
+                    _lines.append(_line)
+                _lines.append(str_divider)
+                _lines.append('%s %d     %s%d' % (str_iteration, int((now.replace(tzinfo=None)-pipeline.last).total_seconds()/60)+1, str_stints, pipeline.stints))
+                _lines.append('%s  %s' % (str_reloaded, pipeline.last.strftime("%H:%M:%S %a, %d-%b-%Y")))
+                _age = fetcher.age(clock.time())
+                _line = '%s %s' % (str_data_age, '-' if _age is None else int(_age/60))
+                if pipeline.stale:
+                    _line = _line + '  ' + str_stale
+                _lines.append(_line)
+                _lines.append(str_exit_msg + str_exit_chars)
+                if playback_latency is not None:
+                    _lines.append('%s %d' % (str_latency, int(playback_latency*1000)))
+                renderer.render(_lines)
+                # countdowns tick every second on a terminal, log lines once a minute
+                next_status = _now + (1 if renderer.tty else 60)
             
-        # wait a minute or exit if event is set
-        exit.wait(60)
-        
-        # reload calendar every refresh_timer minutes    
-        counter = counter + 1     
-        if counter >=    (refresh_timer):
-            events = get_events(number_events)
-            counter = 0
-            stints = stints + 1
-            last = now   
+            if metrics_file and _now >= next_metrics:
+                metrics.write(filepath+metrics_file)
+                next_metrics = _now + 60
+
+            # open files, threads and memory, a leak shows in the trend long before it hurts
+            if _now >= resources.next_sample:
+                resources.sample(_now)
+
+            # sleep until the next alert, refresh or status output is due, or exit if event is set
+            _wake = pipeline.next_wake()
+            if metrics_file:
+                _wake = min(_wake, next_metrics)
+            if status_output:
+                _wake = min(_wake, next_status)
+            _wake = min(_wake, prefs_watch.next_check, resources.next_sample)
+            _typed = loop.wait(max(0, _wake - clock.time()))
+            if any(_c in str_exit_chars for _c in _typed):
+                # quit condition
+                wrapup_and_quit()
+            _prefs_changed = prefs_watch.changed(clock.time())
+            if reload_requested.is_set() or _prefs_changed:
+                if reload_requested.is_set():
+                    # SIGHUP: reload prefs and the calendars right away
+                    reload_requested.clear()
+                    pipeline.next_refresh = clock.time()
+                if apply_prefs_changes(reload_prefs(prefsfile), prerendered, scheduler, pipeline.next_refresh - clock.time() + 60):
+                    pipeline.next_refresh = clock.time()
+                if daemon:
+                    # no terminal to draw on
+                    status_output = False
+                if status_output:
+                    renderer.capture()
+                else:
+                    renderer.release()
+                renderer.invalidate()
+                next_status = clock.time()
+
+    renderer.release()
+    # closed here and not in the signal handler, which could interrupt a save holding the lock
+    if calendar_snapshot is not None:
+        try:
+            calendar_snapshot.close()
+        except sqlite3.Error:
+            pass
+    if pidfile is not None and os.path.exists(pidfile):
+        os.remove(pidfile)
+    notify_service_manager('STOPPING=1')
                  
 #
 #============================================================             
 def wrapup_and_quit():
-    """remove temp files and set exit flag"""
-    global filepath
-    if filepath == '':
-        filepath = '.'
-    if Path(filepath+path_delim+str_tts_sound_file).exists():
-        os.remove(filepath+path_delim+str_tts_sound_file)
-
-    if Path(filepath+path_delim+str_play_sound_file).exists():
-        os.remove(filepath+path_delim+str_play_sound_file)
+    """set exit flag"""
     exit.set()     
+    if loop is not None:
+        loop.wake()
        
 #
 #============================================================             
@@ -587,14 +3334,25 @@ def leave_on_signal(signo, _frame):
     print(str_signal, signo)
     wrapup_and_quit()     
 
+#
+#============================================================             
+def reload_on_signal(signo, _frame):
+    """reload prefs and calendars on SIGHUP"""
+    reload_requested.set()
+
+# everything above is the import of this module
+import_seconds = time.perf_counter() - import_started
+
 #
 #============================================================             
 if __name__ == '__main__':
     
         
     for sig in ('TERM', 'INT'):
-    #for sig in ('TERM', 'HUP', 'INT'): <=== SIGHUP is not defined in Windows
         signal.signal(getattr(signal, 'SIG'+sig), leave_on_signal);
+    # SIGHUP is not defined in Windows
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, reload_on_signal)
     
     main(sys.argv[1:])
 
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#==========================================================
+# Component benchmarks for CalSpeechReminder
+#
+# Times the stages between "alert is due" and "first sound
+# out of the speaker" without network or audio hardware:
+# fake Calendar API responses, a stub text-to-speech engine
+# and a null audio sink which discards the PCM stream.
+#
+# Reports p50/p99 latency per stage and the peak RSS, and
+# optionally writes the results as JSON so regressions can
+# be tracked across releases.
+#
+# Usage: bench_components.py [--sizes 10,100,1000,10000]
+#                            [--repeat 20] [--json <file>]
+#==========================================================
+#
+from __future__ import print_function
+import datetime
+import getopt
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import CalSpeechReminder as csr
+from pydub.generators import Sine
+
+#
+#============================================================
+class fake_calendar():
+    """Stand-in for service.events() answering list() with n synthetic
+    events, paged like the Calendar API"""
+    def __init__(self, number):
+        _now = datetime.datetime.now().astimezone()
+        self.items = []
+        for _i in range(number):
+            _start = _now + datetime.timedelta(minutes=3 + _i*7)
+            self.items.append({'id': 'event%d' % _i, 'status': 'confirmed', 'summary': 'Meeting %d' % _i,
+                               'start': {'dateTime': _start.isoformat()},
+                               'end': {'dateTime': (_start + datetime.timedelta(minutes=30)).isoformat()},
+                               'updated': _now.isoformat()})
+
+    def events(self):
+        return self
+
+    def list(self, **kwargs):
+        _items = self.items
+        _page_size = kwargs.get('maxResults', 250)
+        _offset = int(kwargs.get('pageToken') or 0)
+
+        class _request():
+            def execute(_self):
+                _result = {'items': _items[_offset:_offset+_page_size]}
+                if _offset + _page_size < len(_items):
+                    _result['nextPageToken'] = str(_offset + _page_size)
+                else:
+                    _result['nextSyncToken'] = 'sync'
+                return _result
+        return _request()
+
+#
+#============================================================
+class fake_source():
+    """Calendar source without Google client"""
+    def __init__(self, events):
+        self.name = 'bench'
+        self.calendar_id = 'bench'
+        self.language = 'en_US'
+        self.alerts = [10, 5, 1]
+        self.sink = ''
+        self.events = events
+
+#
+#============================================================
+class stub_tts():
+    """Text-to-speech stand-in returning a tone of plausible length"""
+    def segment(self, text, lang):
+        return Sine(440, sample_rate=24000).to_audio_segment(duration=60*len(text)).set_channels(1)
+
+#
+#============================================================
+class stub_assets(csr.sound_assets):
+    """Asset registry serving generated sounds instead of decoding mp3 files"""
+    def get(self, sound_file):
+        if not sound_file:
+            return None
+        with self.lock:
+            if sound_file not in self.segments:
+                self.segments[sound_file] = ((0, 0), Sine(220).to_audio_segment(duration=1500).set_channels(2))
+            return self.segments[sound_file][1]
+
+#
+#============================================================
+def measure(function, repeat):
+    """Run function repeat times, return p50/p99/max in milliseconds"""
+    _times = []
+    for _i in range(repeat):
+        _started = time.perf_counter()
+        function()
+        _times.append((time.perf_counter() - _started) * 1000)
+    return summarize(_times)
+
+#
+#============================================================
+def summarize(times):
+    """Return p50/p99/max of times in milliseconds"""
+    _times = sorted(times)
+    if len(_times) > 1:
+        _p99 = statistics.quantiles(_times, n=100, method='inclusive')[98]
+    else:
+        _p99 = _times[0]
+    return {'p50_ms': round(statistics.median(_times), 3), 'p99_ms': round(_p99, 3), 
+            'max_ms': round(_times[-1], 3), 'runs': len(_times)}
+
+#
+#============================================================
+def peak_rss_kb():
+    """Peak resident set size of this process in kB"""
+    _rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux kB
+    return _rss // 1024 if platform.system() == 'Darwin' else _rss
+
+#
+#============================================================
+def bench_import(repeat):
+    """Import of the script in a fresh interpreter, as on every start"""
+    _directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    _times = []
+    for _i in range(repeat):
+        # timed by the script itself, without the start of the interpreter
+        _output = subprocess.check_output([sys.executable, '-W', 'ignore', '-c', 
+                                           'import CalSpeechReminder; print(CalSpeechReminder.import_seconds)'], cwd=_directory)
+        _times.append(float(_output) * 1000)
+    _result = summarize(_times)
+    _result['budget_ms'] = csr.IMPORT_BUDGET * 1000
+    return _result
+
+#
+#============================================================
+def bench_fetch(number, repeat):
+    """Full sync of the local event store plus selection of the upcoming events"""
+    _service = fake_calendar(number)
+
+    def _run():
+        _store = csr.event_store('bench', 365)
+        _store.sync(_service)
+        _store.upcoming(csr.number_events)
+    return measure(_run, repeat)
+
+#
+#============================================================
+def bench_schedule(number, repeat):
+    """Rebuild of the alert schedule after a refresh and the work done on 
+    every wakeup of the main loop (due alerts, next deadline)"""
+    _source = fake_source(csr.event_index(csr.event_record.from_item(_item) for _item in fake_calendar(number).items))
+
+    def _run():
+        _scheduler = csr.alert_scheduler()
+        _scheduler.update([_source])
+        _scheduler.pop_due(time.time())
+        _scheduler.next_deadline()
+    return measure(_run, repeat)
+
+#
+#============================================================
+def bench_render(repeat, fragments=True):
+    """Assembly of the alert clip: lead-in (silence + gong) plus speech, 
+    joined from the cached parts or synthesized as a whole"""
+    csr.speech_fragments = fragments
+    return measure(lambda: csr.render_alerts([('Weekly planning meeting', 5)], 'en_US', True), repeat)
+
+#
+#============================================================
+def bench_playback(repeat, sink=''):
+    """Streaming of a rendered clip to null sinks, plus time to first sample"""
+    _clip = csr.render_alerts([('Weekly planning meeting', 5)], 'en_US', True)
+    _first_sample = []
+
+    def _run():
+        csr._play_with_ffplay_suppress(_clip, None, sink)
+        _first_sample.append(csr.playback_latency * 1000)
+    _result = measure(_run, repeat)
+    _result['first_sample_p50_ms'] = round(statistics.median(_first_sample), 3)
+    return _result
+
+#
+#============================================================
+def print_usage():
+    """Print Usage message"""
+    print('Usage:')
+    print(os.path.basename(str(sys.argv[0])), '[--sizes 10,100,1000,10000] [--repeat 20] [--json <file>]')
+
+#
+#============================================================
+def main(argv):
+    _sizes = [10, 100, 1000, 10000]
+    _repeat = 20
+    _json_file = None
+    try:
+        opts, args = getopt.getopt(argv, "h", ["help", "sizes=", "repeat=", "json="])
+    except getopt.GetoptError:
+        print_usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print_usage()
+            sys.exit()
+        elif opt == "--sizes":
+            _sizes = [int(_size) for _size in arg.split(',')]
+        elif opt == "--repeat":
+            _repeat = int(arg)
+        elif opt == "--json":
+            _json_file = arg
+
+    # defaults of the script, a scratch base directory, no network, no sound card
+    csr.load_defaults()
+    _scratch = tempfile.mkdtemp(prefix='csr_bench')
+    csr.filepath = _scratch + os.sep
+    csr.path_delim = os.sep
+    csr.tts = stub_tts()
+    csr.assets = stub_assets()
+    # null sink: a child process which reads and discards the PCM stream
+    csr.get_pcm_player = lambda seg, sink='': ([sys.executable, '-c', 'import sys; sys.stdin.buffer.read()'], False)
+
+    _results = {'python': platform.python_version(), 'machine': platform.machine(), 'timestamp': time.time(), 'stages': {}}
+    try:
+        for _size in _sizes:
+            # large calendars are expensive, keep the run time sane
+            _runs = max(3, _repeat * 100 // max(_size, 100))
+            _results['stages']['fetch_%d' % _size] = bench_fetch(_size, _runs)
+            _results['stages']['schedule_%d' % _size] = bench_schedule(_size, _runs)
+        _results['stages']['import'] = bench_import(max(3, _repeat // 4))
+        _results['stages']['render'] = bench_render(_repeat)
+        _results['stages']['render_whole'] = bench_render(_repeat, fragments=False)
+        _results['stages']['playback'] = bench_playback(max(3, _repeat // 4))
+        # fan-out of the same buffer to three outputs, one of them with latency compensation
+        _results['stages']['playback_3_sinks'] = bench_playback(max(3, _repeat // 4), 
+                                                                [{'device': 'a'}, {'device': 'b', 'lead_in_ms': '250'}, {'device': 'c', 'latency_ms': '250'}])
+    finally:
+        # the scratch directory holds the cached clips of this run
+        shutil.rmtree(_scratch, ignore_errors=True)
+    _results['peak_rss_kb'] = peak_rss_kb()
+
+    print('%-20s %10s %10s %10s %6s' % ('stage', 'p50 ms', 'p99 ms', 'max ms', 'runs'))
+    for _stage, _result in _results['stages'].items():
+        print('%-20s %10.3f %10.3f %10.3f %6d' % (_stage, _result['p50_ms'], _result['p99_ms'], _result['max_ms'], _result['runs']))
+    print('time to first sample (p50 ms):', _results['stages']['playback']['first_sample_p50_ms'])
+    print('peak RSS (kB):', _results['peak_rss_kb'])
+    if _results['stages']['import']['p50_ms'] > _results['stages']['import']['budget_ms']:
+        print('import takes longer than its budget of %d ms' % _results['stages']['import']['budget_ms'])
+    if _json_file is not None:
+        with open(_json_file, 'w') as f:
+            json.dump(_results, f, indent=2)
+
+#
+#============================================================
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#==========================================================
+# Tests of the incremental calendar sync of CalSpeechReminder
+#
+# Runs event_store against a local stand-in of the Calendar
+# API: sync token continuation, cancelled events and the
+# full resync after an expired sync token (HTTP 410).
+#
+# Usage: python -m unittest discover tests
+#==========================================================
+#
+from __future__ import print_function
+import datetime
+import os
+import sys
+import unittest
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import CalSpeechReminder as csr
+
+#
+#============================================================
+def event(id, minutes, summary=None, status='confirmed'):
+    """An event as returned by the Calendar API, starting in minutes from now"""
+    _start = datetime.datetime.now().astimezone() + datetime.timedelta(minutes=minutes)
+    return {'id': id, 'summary': summary or 'Meeting ' + id, 'status': status,
+            'start': {'dateTime': _start.isoformat()},
+            'end': {'dateTime': (_start + datetime.timedelta(minutes=30)).isoformat()}}
+
+#
+#============================================================
+class fake_calendar():
+    """Stand-in for the Calendar service. A full listing hands out a sync
+    token, a request with a token returns the changes made since, an expired
+    token is answered with HTTP 410 like the real API does. Without tokens
+    a request with updatedMin returns the changes made since"""
+    def __init__(self, items, tokens=True):
+        self.items = dict((_item['id'], _item) for _item in items)
+        self.changes = []
+        self.tokens = tokens
+        self.token = 0
+        self.expired = False
+        self.requests = []
+
+    def change(self, item):
+        self.items[item['id']] = item
+        self.changes.append(item)
+
+    def events(self):
+        return self
+
+    def list(self, **kwargs):
+        self.requests.append(kwargs)
+        _self = self
+
+        class _request():
+            def execute(_request_self):
+                if 'syncToken' in kwargs:
+                    if _self.expired:
+                        _self.expired = False
+                        raise HttpError(httplib2.Response({'status': 410}), b'Sync token is no longer valid')
+                    if kwargs['syncToken'] != 'token%d' % _self.token:
+                        raise AssertionError('unexpected sync token ' + kwargs['syncToken'])
+                    _items = _self.changes
+                elif 'updatedMin' in kwargs:
+                    _items = _self.changes
+                else:
+                    _items = [_item for _item in _self.items.values() if _item['status'] != 'cancelled']
+                _self.changes = []
+                _self.token += 1
+                if not _self.tokens:
+                    return {'items': _items}
+                return {'items': _items, 'nextSyncToken': 'token%d' % _self.token}
+        return _request()
+
+#
+#============================================================
+class event_store_test(unittest.TestCase):
+
+    def setUp(self):
+        csr.load_defaults()
+        csr.api_quota = None
+        self.service = fake_calendar([event('a', 30), event('b', 60), event('c', 90)])
+        self.store = csr.event_store('primary', 7)
+        self.store.sync(self.service)
+
+    def test_full_sync_first(self):
+        self.assertNotIn('syncToken', self.service.requests[0])
+        self.assertEqual(self.store.sync_token, 'token1')
+        self.assertEqual(sorted(self.store.events), ['a', 'b', 'c'])
+
+    def test_sync_token_continuation(self):
+        self.service.change(event('d', 120))
+        self.service.change(event('a', 45, 'Moved'))
+        _changed = self.store.sync(self.service)
+        self.assertEqual(self.service.requests[-1]['syncToken'], 'token1')
+        self.assertEqual(len(_changed), 2)
+        self.assertEqual(self.store.sync_token, 'token2')
+        self.assertEqual(self.store.events['a'].summary, 'Moved')
+        self.assertEqual(sorted(self.store.events), ['a', 'b', 'c', 'd'])
+        # nothing changed, the next request continues with the new token
+        self.assertEqual(self.store.sync(self.service), [])
+        self.assertEqual(self.service.requests[-1]['syncToken'], 'token2')
+
+    def test_cancelled_events_are_removed(self):
+        self.service.change(event('b', 60, status='cancelled'))
+        self.store.sync(self.service)
+        self.assertEqual(sorted(self.store.events), ['a', 'c'])
+        self.assertEqual([_event.id for _event in self.store.upcoming(10)], ['a', 'c'])
+
+    def test_expired_token_falls_back_to_full_sync(self):
+        self.service.expired = True
+        self.service.items['e'] = event('e', 15)
+        del self.service.items['c']
+        self.store.sync(self.service)
+        self.assertIn('syncToken', self.service.requests[-2])
+        self.assertNotIn('syncToken', self.service.requests[-1])
+        self.assertEqual(sorted(self.store.events), ['a', 'b', 'e'])
+        self.assertEqual(self.store.sync_token, 'token2')
+
+    def test_other_errors_are_raised(self):
+        def _fail(**kwargs):
+            raise HttpError(httplib2.Response({'status': 500}), b'Backend error')
+        self.service.list = _fail
+        with self.assertRaises(HttpError):
+            self.store.sync(self.service)
+        self.assertEqual(self.store.sync_token, 'token1')
+
+    def test_updated_min_without_sync_token(self):
+        self.service = fake_calendar([event('a', 30), event('b', 60), event('c', 90)], tokens=False)
+        self.store = csr.event_store('primary', 7)
+        self.store.sync(self.service)
+        self.assertIsNone(self.store.sync_token)
+        # moved out of the sync window, still has to replace the old start
+        self.service.change(event('a', 14*24*60, 'Postponed'))
+        self.service.change(event('b', 60, status='cancelled'))
+        self.store.sync(self.service)
+        _request = self.service.requests[-1]
+        self.assertIn('updatedMin', _request)
+        self.assertTrue(_request['showDeleted'])
+        self.assertNotIn('timeMin', _request)
+        self.assertNotIn('timeMax', _request)
+        self.assertEqual(self.store.events['a'].summary, 'Postponed')
+        self.assertEqual([_event.id for _event in self.store.upcoming(10)], ['c', 'a'])
+
+if __name__ == '__main__':
+    unittest.main()